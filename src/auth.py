@@ -0,0 +1,34 @@
+import os
+from typing import NamedTuple
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+load_dotenv()
+
+from src.cache import TTLCache
+from src.models import Users
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 60))
+
+
+class Principal(NamedTuple):
+    id: int
+    name: str
+
+    def to_json(self):
+        return {"id": self.id, "name": self.name}
+
+
+auth_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def invalidate_user(user_id: int) -> None:
+    auth_cache.invalidate_where(lambda principal: principal.id == user_id)
+
+
+@event.listens_for(Users, "after_update")
+@event.listens_for(Users, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_user(target.id)
@@ -0,0 +1,409 @@
+"""Load-test harness for the API.
+
+    python -m src.benchmark run --users 1000 --fanout 50 --tweets 10 \\
+        --requests 2000 --concurrency 32 --output run.json
+    python -m src.benchmark compare baseline.json run.json
+
+``run`` seeds a synthetic social graph into the configured database (only
+into an empty one, or after ``--reset``) and drives the API either
+in-process or, with ``--base-url``, against a running server. The graph and
+the request mix are derived from ``--seed``, so two runs with the same
+arguments issue the same requests.
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+load_dotenv()
+
+from src.bulk_load import GraphConfig, bulk_load, generate_graph
+from src.database import engine
+from src.models import Base, Likes, Tweets, Users
+
+SCENARIOS = ("feed", "profile", "post_tweet", "like", "media")
+# random picks of a tweet to like before scanning for the ones left
+LIKE_ATTEMPTS = 20
+
+
+@dataclass
+class Graph:
+    user_ids: List[int]
+    api_keys: Dict[int, str]
+    tweet_ids: List[int]
+    likes: Set[Tuple[int, int]]
+
+
+async def seed_graph(
+    config: GraphConfig, db_engine: AsyncEngine = engine, reset: bool = False
+) -> Graph:
+    """Bulk load the synthetic graph of ``config`` into an empty database."""
+    async with db_engine.begin() as conn:
+        if reset:
+            await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        if await conn.scalar(select(func.count()).select_from(Users)):
+            raise RuntimeError("The database is not empty, seed it with --reset")
+    await bulk_load(generate_graph(config), db_engine)
+    async with db_engine.connect() as conn:
+        user_ids = list(await conn.scalars(select(Users.id).order_by(Users.id)))
+        api_keys = dict((await conn.execute(select(Users.id, Users.api_key))).all())
+        tweet_ids = list(await conn.scalars(select(Tweets.id).order_by(Tweets.id)))
+        likes = set((await conn.execute(select(Likes.tweet_id, Likes.user_id))).all())
+    return Graph(user_ids, api_keys, tweet_ids, likes)
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Linearly interpolated percentile of already sorted ``values``."""
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class QueryCounter:
+    def __init__(self, db_engine: AsyncEngine):
+        self.engine = db_engine.sync_engine
+        self.count = 0
+
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+
+
+class Workload:
+    """Builds the requests of each scenario from a seeded random generator."""
+
+    def __init__(self, graph: Graph, seed: int):
+        self.graph = graph
+        self.rng = random.Random(seed)
+        self.likes = set(graph.likes)
+
+    def unliked_tweet(self, user_id: int) -> Optional[int]:
+        for _ in range(LIKE_ATTEMPTS):
+            tweet_id = self.rng.choice(self.graph.tweet_ids)
+            if (tweet_id, user_id) not in self.likes:
+                return tweet_id
+        unliked = [
+            tweet_id
+            for tweet_id in self.graph.tweet_ids
+            if (tweet_id, user_id) not in self.likes
+        ]
+        return self.rng.choice(unliked) if unliked else None
+
+    def request(self, scenario: str, n: int) -> dict:
+        user_id = self.rng.choice(self.graph.user_ids)
+        headers = {"api-key": self.graph.api_keys[user_id]}
+        if scenario == "feed":
+            return {"method": "GET", "url": "/api/tweets", "headers": headers}
+        if scenario == "profile":
+            target = self.rng.choice(self.graph.user_ids)
+            return {"method": "GET", "url": f"/api/users/{target}", "headers": headers}
+        if scenario == "post_tweet":
+            return {
+                "method": "POST",
+                "url": "/api/tweets",
+                "headers": headers,
+                "json": {"tweet_data": f"Load test tweet {n}", "tweet_media_ids": []},
+            }
+        if scenario == "like":
+            # pick a tweet this user has not liked yet, so every like succeeds
+            tweet_id = self.unliked_tweet(user_id)
+            if tweet_id is None:
+                # the user liked everything, keep the request count with a read
+                return {"method": "GET", "url": "/api/tweets", "headers": headers}
+            self.likes.add((tweet_id, user_id))
+            return {
+                "method": "POST",
+                "url": f"/api/tweets/{tweet_id}/likes",
+                "headers": headers,
+            }
+        if scenario == "media":
+            content = self.rng.randbytes(4096)
+            return {
+                "method": "POST",
+                "url": "/api/medias",
+                "headers": headers,
+                "files": {"file": (f"bench-{n}.png", content, "image/png")},
+            }
+        raise ValueError(f"Unknown scenario {scenario}")
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    workload: Workload,
+    scenario: str,
+    requests: int,
+    concurrency: int,
+    queries: Optional[QueryCounter],
+) -> dict:
+    pending = [workload.request(scenario, n) for n in range(requests)]
+    pending.reverse()
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        while pending:
+            kwargs = pending.pop()
+            started = time.perf_counter()
+            response = await client.request(**kwargs)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    queries_before = queries.count if queries else 0
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 3),
+            "p95": round(percentile(latencies, 95) * 1000, 3),
+            "p99": round(percentile(latencies, 99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        "queries_per_request": (
+            round((queries.count - queries_before) / requests, 2)
+            if queries and requests
+            else None
+        ),
+    }
+
+
+async def run(
+    config: GraphConfig,
+    scenarios: Sequence[str],
+    requests: int,
+    concurrency: int,
+    base_url: Optional[str] = None,
+    reset: bool = False,
+) -> dict:
+    graph = await seed_graph(config, reset=reset)
+    workload = Workload(graph, config.seed)
+    results = {}
+    if base_url:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            for scenario in scenarios:
+                results[scenario] = await run_scenario(
+                    client, workload, scenario, requests, concurrency, None
+                )
+    else:
+        from src.main import app, shutdown, startup
+
+        # statement logging would be measured as part of every request
+        engine.echo = False
+        await startup()
+        try:
+            async with httpx.AsyncClient(
+                app=app, base_url="http://bench", timeout=60
+            ) as client:
+                with QueryCounter(engine) as queries:
+                    for scenario in scenarios:
+                        results[scenario] = await run_scenario(
+                            client, workload, scenario, requests, concurrency, queries
+                        )
+        finally:
+            await shutdown()
+    return {
+        "config": asdict(config),
+        "requests": requests,
+        "concurrency": concurrency,
+        "target": base_url or "in-process",
+        "database": engine.dialect.name,
+        "python": platform.python_version(),
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "scenarios": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> List[str]:
+    """Return a description of every metric that got worse than ``threshold``.
+
+    Latency percentiles and query counts regress when they grow and
+    throughput when it drops, by more than ``threshold`` as a fraction of
+    the baseline. Any new error counts as a regression.
+    """
+    regressions = []
+    for scenario, old in baseline["scenarios"].items():
+        new = current["scenarios"].get(scenario)
+        if new is None:
+            continue
+        checks: Dict[str, Tuple[Optional[float], Optional[float], int]] = {
+            f"latency {name}": (old["latency_ms"][name], new["latency_ms"][name], 1)
+            for name in ("p50", "p95", "p99")
+        }
+        checks["throughput"] = (old["throughput_rps"], new["throughput_rps"], -1)
+        checks["queries per request"] = (
+            old["queries_per_request"],
+            new["queries_per_request"],
+            1,
+        )
+        for name, (before, after, direction) in checks.items():
+            if before is None or after is None or not before:
+                continue
+            change = (after - before) / before
+            if change * direction > threshold:
+                regressions.append(
+                    f"{scenario}: {name} {before} -> {after} ({change:+.1%})"
+                )
+        if new["errors"] > old["errors"]:
+            regressions.append(f"{scenario}: errors {old['errors']} -> {new['errors']}")
+    return regressions
+
+
+def feed_sample(tweets: int, likes: int) -> List[dict]:
+    users = [{"id": n, "name": f"Bench user {n}"} for n in range(likes + 1)]
+    return [
+        {
+            "content": f"Benchmark tweet {n} with some text in it",
+            "id": n,
+            "attachments": [f"/storage/blobs/ab/cd/{n:064x}.jpg"],
+            "attachment_variants": [
+                {"w320": f"/storage/variants/ab/cd/{n:064x}.jpg/w320.webp"}
+            ],
+            "author": users[0],
+            "likes": [{"user_id": u["id"], "name": u["name"]} for u in users[1:]],
+            "like_count": likes,
+        }
+        for n in range(tweets)
+    ]
+
+
+async def benchmark_serialization(tweets: int, likes: int, iterations: int) -> dict:
+    """Time encoding a feed page through response_model against the fast path."""
+    from fastapi.responses import JSONResponse, ORJSONResponse
+    from fastapi.routing import serialize_response
+
+    from src.main import app
+    from src.serialization import feed_payload
+
+    route = next(
+        route
+        for route in app.routes
+        if getattr(route, "path", None) == "/api/tweets" and "GET" in route.methods
+    )
+    payload = feed_payload(feed_sample(tweets, likes), None)
+
+    async def validated():
+        content = await serialize_response(
+            field=route.response_field, response_content=payload
+        )
+        return JSONResponse(content).body
+
+    async def fast():
+        return ORJSONResponse(payload).body
+
+    assert await validated() == await fast()
+    results = {}
+    for name, render in (("response_model", validated), ("orjson", fast)):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await render()
+        results[name] = round((time.perf_counter() - started) / iterations * 1000, 3)
+    return {
+        "tweets": tweets,
+        "likes_per_tweet": likes,
+        "iterations": iterations,
+        "response_bytes": len(await fast()),
+        "ms_per_response": results,
+        "speedup": round(results["response_model"] / results["orjson"], 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API load test")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="seed the database and load it")
+    defaults = GraphConfig()
+    run_parser.add_argument("--users", type=int, default=defaults.users)
+    run_parser.add_argument("--fanout", type=int, default=defaults.fanout)
+    run_parser.add_argument("--tweets", type=int, default=defaults.tweets)
+    run_parser.add_argument("--likes", type=int, default=defaults.likes)
+    run_parser.add_argument("--seed", type=int, default=defaults.seed)
+    run_parser.add_argument("--requests", type=int, default=1000)
+    run_parser.add_argument("--concurrency", type=int, default=16)
+    run_parser.add_argument(
+        "--scenario", choices=SCENARIOS, action="append", dest="scenarios"
+    )
+    run_parser.add_argument("--base-url", help="load a running server instead")
+    run_parser.add_argument(
+        "--reset", action="store_true", help="drop all tables before seeding"
+    )
+    run_parser.add_argument("--output", help="write the report here")
+    compare_parser = commands.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    serialize_parser = commands.add_parser(
+        "serialize", help="time the feed response encoding"
+    )
+    serialize_parser.add_argument("--tweets", type=int, default=200)
+    serialize_parser.add_argument("--likes", type=int, default=20)
+    serialize_parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "serialize":
+        report = asyncio.run(
+            benchmark_serialization(args.tweets, args.likes, args.iterations)
+        )
+        print(json.dumps(report, indent=2))
+    elif args.command == "run":
+        config = GraphConfig(
+            args.users, args.fanout, args.tweets, args.likes, args.seed
+        )
+        report = asyncio.run(
+            run(
+                config,
+                args.scenarios or SCENARIOS,
+                args.requests,
+                args.concurrency,
+                args.base_url,
+                args.reset,
+            )
+        )
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(text + "\n")
+        print(text)
+    elif args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for line in regressions:
+            print(line)
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,360 @@
+"""Bulk loading of users, tweets, follows, likes and media.
+
+    python -m src.bulk_load import --users users.csv --follows follows.jsonl
+    python -m src.bulk_load generate --users 1000000 --fanout 10 --tweets 5
+
+Every load runs in one transaction: secondary indexes (and, on Postgres,
+foreign keys and the primary keys of the link tables) are dropped, the rows
+are streamed in with asyncpg's COPY on Postgres or batched executemany on
+SQLite, and then the indexes and constraints are created again, which checks
+all loaded rows at once. Denormalized counters are recomputed at the end.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from typing import Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import DateTime, Integer, Table, inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+load_dotenv()
+
+from src.database import engine
+from src.models import Base
+
+BULK_BATCH_SIZE = 10000
+
+# command line option -> table
+TABLE_OPTIONS = {
+    "users": "users",
+    "tweets": "tweets",
+    "follows": "followers",
+    "likes": "likes",
+    "media_blobs": "media_blobs",
+    "media": "media",
+}
+
+Source = Tuple[Sequence[str], Iterable[tuple]]
+
+
+@dataclass
+class GraphConfig:
+    users: int = 1000
+    fanout: int = 50
+    tweets: int = 10
+    likes: int = 5
+    seed: int = 1
+
+
+def generate_graph(config: GraphConfig) -> Dict[str, Source]:
+    """Lazily generated rows of a synthetic graph with ids starting at 1.
+
+    ``config.fanout`` is how many users each user follows, ``config.tweets``
+    how many tweets each user has written and ``config.likes`` how many likes
+    each tweet has received. Every table draws from its own generator, so the
+    rows only depend on the config.
+    """
+    user_ids = range(1, config.users + 1)
+    tweet_count = config.users * config.tweets
+    started = datetime.utcnow() - timedelta(seconds=tweet_count)
+
+    def follows():
+        rng = random.Random(f"{config.seed}-follows")
+        fanout = min(config.fanout, config.users - 1)
+        for user_id in user_ids:
+            followees = [f for f in rng.sample(user_ids, fanout + 1) if f != user_id]
+            for followee in followees[:fanout]:
+                yield user_id, followee
+
+    def tweets():
+        rng = random.Random(f"{config.seed}-tweets")
+        for tweet_id in range(1, tweet_count + 1):
+            yield (
+                tweet_id,
+                rng.choice(user_ids),
+                f"Generated tweet {tweet_id}",
+                started + timedelta(seconds=tweet_id),
+            )
+
+    def likes():
+        rng = random.Random(f"{config.seed}-likes")
+        per_tweet = min(config.likes, config.users)
+        for tweet_id in range(1, tweet_count + 1):
+            for user_id in rng.sample(user_ids, per_tweet):
+                yield tweet_id, user_id
+
+    return {
+        "users": (
+            ("id", "name", "api_key"),
+            ((n, f"User {n}", f"bench-{n}") for n in user_ids),
+        ),
+        "followers": (("user_id", "follower_id"), follows()),
+        "tweets": (("id", "author", "content", "created_at"), tweets()),
+        "likes": (("tweet_id", "user_id"), likes()),
+    }
+
+
+def _converter(column) -> Callable[[str], object]:
+    if isinstance(column.type, Integer):
+        convert = int
+    elif isinstance(column.type, DateTime):
+        convert = datetime.fromisoformat
+    else:
+        convert = str
+    return lambda value: None if value in ("", None) else convert(value)
+
+
+def read_source(path: str, table: Table) -> Source:
+    """Stream the rows of a CSV file with a header line or of a JSONL file."""
+    f = open(path, newline="")
+    if path.endswith(".jsonl"):
+        records = (json.loads(line) for line in f if line.strip())
+    else:
+        records = csv.DictReader(f)
+    first = next(iter(records), None)
+    if first is None:
+        f.close()
+        return (), ()
+    columns = list(first)
+    unknown = set(columns) - set(table.c.keys())
+    if unknown:
+        f.close()
+        raise ValueError(f"{path}: unknown {table.name} columns {sorted(unknown)}")
+    converters = [_converter(table.c[name]) for name in columns]
+
+    def rows():
+        with f:
+            for record in chain([first], records):
+                yield tuple(
+                    convert(record.get(name))
+                    for convert, name in zip(converters, columns)
+                )
+
+    return columns, rows()
+
+
+def _batches(rows: Iterable[tuple], size: int) -> Iterator[List[tuple]]:
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def _drop_constraints(sync_conn, tables: Sequence[Table]) -> List[tuple]:
+    inspector = inspect(sync_conn)
+    postgres = sync_conn.dialect.name == "postgresql"
+    referenced = {
+        fk.column.table.name
+        for table in Base.metadata.sorted_tables
+        for fk in table.foreign_keys
+    }
+    dropped = []
+    for table in tables:
+        for index in inspector.get_indexes(table.name):
+            if index.get("duplicates_constraint"):
+                continue
+            dropped.append(("index", table, index))
+            sync_conn.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+        if not postgres:
+            continue
+        for foreign_key in inspector.get_foreign_keys(table.name):
+            dropped.append(("foreign_key", table, foreign_key))
+            _drop_constraint(sync_conn, table, foreign_key["name"])
+        # the primary keys of the link tables are their biggest index, the
+        # ones other tables refer to have to stay
+        if table.name not in referenced:
+            primary_key = inspector.get_pk_constraint(table.name)
+            dropped.append(("primary_key", table, primary_key))
+            _drop_constraint(sync_conn, table, primary_key["name"])
+    return dropped
+
+
+def _restore_constraints(sync_conn, dropped: List[tuple]) -> None:
+    order = {"primary_key": 0, "index": 1, "foreign_key": 2}
+    for kind, table, spec in sorted(dropped, key=lambda item: order[item[0]]):
+        if kind == "index":
+            unique = "UNIQUE " if spec["unique"] else ""
+            sync_conn.exec_driver_sql(
+                f'CREATE {unique}INDEX "{spec["name"]}" ON "{table.name}" '
+                f'({_column_list(spec["column_names"])})'
+            )
+        elif kind == "primary_key":
+            sync_conn.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" ADD CONSTRAINT "{spec["name"]}" '
+                f'PRIMARY KEY ({_column_list(spec["constrained_columns"])})'
+            )
+        else:
+            sync_conn.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" ADD CONSTRAINT "{spec["name"]}" '
+                f'FOREIGN KEY ({_column_list(spec["constrained_columns"])}) '
+                f'REFERENCES "{spec["referred_table"]}" '
+                f'({_column_list(spec["referred_columns"])})'
+            )
+
+
+def _column_list(names: Sequence[str]) -> str:
+    return ", ".join(f'"{name}"' for name in names)
+
+
+def _drop_constraint(sync_conn, table: Table, name: str) -> None:
+    sync_conn.exec_driver_sql(f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{name}"')
+
+
+async def _copy_rows(
+    conn: AsyncConnection, table: Table, source: Source, batch_size: int
+) -> int:
+    columns, rows = source
+    if not columns:
+        return 0
+    if conn.dialect.name == "postgresql":
+        raw = await conn.get_raw_connection()
+        status = await raw.driver_connection.copy_records_to_table(
+            table.name, records=rows, columns=list(columns)
+        )
+        return int(status.split()[-1])
+    quote = conn.dialect.identifier_preparer.quote
+    statement = (
+        f"INSERT INTO {quote(table.name)} ({', '.join(map(quote, columns))}) "
+        f"VALUES ({', '.join('?' for _ in columns)})"
+    )
+    count = 0
+    for batch in _batches(rows, batch_size):
+        await conn.exec_driver_sql(statement, batch)
+        count += len(batch)
+    return count
+
+
+async def _check_foreign_keys(conn: AsyncConnection, tables: Sequence[Table]) -> None:
+    if conn.dialect.name != "sqlite":
+        return
+    for table in tables:
+        result = await conn.exec_driver_sql(f'PRAGMA foreign_key_check("{table.name}")')
+        violation = result.first()
+        if violation is not None:
+            raise ValueError(
+                f"{table.name} row {violation[1]} references a missing "
+                f"{violation[2]} row"
+            )
+
+
+async def _reset_sequences(conn: AsyncConnection, tables: Sequence[Table]) -> None:
+    # rows loaded with explicit ids leave the serial sequences behind
+    if conn.dialect.name != "postgresql":
+        return
+    for table in tables:
+        if "id" in table.c and table.c.id.autoincrement:
+            await conn.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                    f'coalesce(max(id), 0) + 1, false) FROM "{table.name}"'
+                )
+            )
+
+
+async def refresh_counters(conn: AsyncConnection, tables: Iterable[str]) -> None:
+    """Recompute the denormalized counters that depend on ``tables``."""
+    tables = set(tables)
+    if tables & {"users", "followers"}:
+        await conn.execute(
+            text(
+                "UPDATE users SET "
+                "follower_count = "
+                "(SELECT count(*) FROM followers WHERE followers.follower_id = users.id), "
+                "following_count = "
+                "(SELECT count(*) FROM followers WHERE followers.user_id = users.id)"
+            )
+        )
+    if tables & {"tweets", "likes"}:
+        await conn.execute(
+            text(
+                "UPDATE tweets SET like_count = "
+                "(SELECT count(*) FROM likes WHERE likes.tweet_id = tweets.id)"
+            )
+        )
+    if tables & {"media", "media_blobs"}:
+        await conn.execute(
+            text(
+                "UPDATE media_blobs SET ref_count = "
+                "(SELECT count(*) FROM media WHERE media.blob = media_blobs.name)"
+            )
+        )
+
+
+async def bulk_load(
+    sources: Dict[str, Source],
+    db_engine: AsyncEngine = engine,
+    batch_size: int = BULK_BATCH_SIZE,
+) -> Dict[str, int]:
+    """Load ``sources`` (table name -> columns and rows) in one transaction.
+
+    Returns the number of rows loaded into each table. A row that breaks a
+    unique or foreign key constraint rolls the whole load back.
+    """
+    tables = [t for t in Base.metadata.sorted_tables if t.name in sources]
+    counts = {}
+    async with db_engine.begin() as conn:
+        dropped = await conn.run_sync(_drop_constraints, tables)
+        for table in tables:
+            counts[table.name] = await _copy_rows(
+                conn, table, sources[table.name], batch_size
+            )
+        await conn.run_sync(_restore_constraints, dropped)
+        await _check_foreign_keys(conn, tables)
+        await _reset_sequences(conn, tables)
+        await refresh_counters(conn, counts)
+    return counts
+
+
+async def _run(sources: Dict[str, Source], batch_size: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    started = datetime.utcnow()
+    counts = await bulk_load(sources, batch_size=batch_size)
+    elapsed = (datetime.utcnow() - started).total_seconds()
+    for table, count in counts.items():
+        print(f"{table}: {count} rows")
+    print(f"Loaded in {elapsed:.1f}s")
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk data loading")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    import_parser = commands.add_parser("import", help="load CSV or JSONL files")
+    for option in TABLE_OPTIONS:
+        import_parser.add_argument(
+            f"--{option.replace('_', '-')}", dest=option, metavar="FILE"
+        )
+    generate = commands.add_parser("generate", help="load a synthetic graph")
+    defaults = GraphConfig()
+    generate.add_argument("--users", type=int, default=defaults.users)
+    generate.add_argument("--fanout", type=int, default=defaults.fanout)
+    generate.add_argument("--tweets", type=int, default=defaults.tweets)
+    generate.add_argument("--likes", type=int, default=defaults.likes)
+    generate.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    if args.command == "import":
+        sources = {
+            table: read_source(path, Base.metadata.tables[table])
+            for option, table in TABLE_OPTIONS.items()
+            if (path := getattr(args, option))
+        }
+        if not sources:
+            parser.error("nothing to import")
+    else:
+        sources = generate_graph(
+            GraphConfig(args.users, args.fanout, args.tweets, args.likes, args.seed)
+        )
+    asyncio.run(_run(sources, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
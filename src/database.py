@@ -1,29 +1,81 @@
+from typing import AsyncGenerator
+
+from sqlalchemy import Select
 from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
 )
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
-def get_database_url():
+def get_database_url(replicas: bool = False):
     if os.environ.get("ENV") == "test":
-        return os.getenv("DATABASE_URL_TEST")
+        name = "DATABASE_URL_TEST"
     elif os.environ.get("ENV") == "debug":
-        return os.getenv("DATABASE_URL_DEBUG")
+        name = "DATABASE_URL_DEBUG"
     else:
-        return os.getenv("DATABASE_URL")
+        name = "DATABASE_URL"
+    # the read replicas of each database are listed comma separated in
+    # <name>_REPLICAS, e.g. DATABASE_URL_REPLICAS
+    return os.getenv(f"{name}_REPLICAS" if replicas else name)
+
+
+def get_pool_options():
+    return {
+        "poolclass": AsyncAdaptedQueuePool,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", 1800)),
+    }
+
+
+def get_replica_urls():
+    return [
+        url.strip() for url in (get_database_url(True) or "").split(",") if url.strip()
+    ]
+
 
+class RoutingSession(Session):
+    """Session that sends SELECTs to ``info["replica"]`` while it is set.
+
+    Writes, flushes and every read outside of a replica block go to the
+    primary; src.replicas decides when a block may use a replica.
+    """
+
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        replica = self.info.get("replica")
+        if replica is not None and not self._flushing and isinstance(clause, Select):
+            return replica.sync_engine
+        return super().get_bind(mapper, clause=clause, **kw)
 
 
 DATABASE_URL = get_database_url()
+# logging every statement slows requests down noticeably, so it is opt-in
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() == "true"
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(DATABASE_URL, echo=DB_ECHO, **get_pool_options())
+replica_engines = [
+    create_async_engine(url, echo=DB_ECHO, **get_pool_options())
+    for url in get_replica_urls()
+]
 
-async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
-session = async_session()
+async_session = async_sessionmaker(
+    engine,
+    expire_on_commit=False,
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+)
 Base = declarative_base()
+
+
+async def get_session() -> AsyncGenerator[AsyncSession, None]:
+    async with async_session() as session:
+        yield session
@@ -1,94 +1,526 @@
 from sqlalchemy.future import select
-from typing import List
-from sqlalchemy.orm import selectinload
+from sqlalchemy import and_, or_, update, delete, func, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from collections import Counter
+from typing import List, Dict, Optional, Set, Tuple
+from datetime import datetime
+from sqlalchemy.orm import selectinload, noload
+from sqlalchemy.ext.asyncio import AsyncSession
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from src.database import session
-from src.models import Tweets, Media, Users, Followers, Likes
+from src.models import Tweets, Media, MediaBlobs, Users, Followers, Likes
+from src.auth import Principal
+from src.replicas import replica_read
+
+
+def dialect_insert(session: AsyncSession, model):
+    # INSERT ... ON CONFLICT is spelled the same way by both supported backends
+    if session.bind.dialect.name == "postgresql":
+        return pg_insert(model)
+    return sqlite_insert(model)
 
 
 class UserService:
     @classmethod
-    async def get_user_api_key(cls, api_key: str) -> Users:
-        user = await session.execute(select(Users).where(Users.api_key == api_key))
-        user = user.scalars().first()
-        return user
+    async def get_user_api_key(
+        cls, session: AsyncSession, api_key: str
+    ) -> Optional[Principal]:
+        user = await session.execute(
+            select(Users.id, Users.name).where(Users.api_key == api_key)
+        )
+        user = user.first()
+        return Principal(user.id, user.name) if user else None
+
+    @classmethod
+    async def change_follow_counts(
+        cls, session: AsyncSession, user_id: int, follower_id: int, delta: int
+    ) -> None:
+        await session.execute(
+            update(Users)
+            .where(Users.id == user_id)
+            .values(following_count=Users.following_count + delta)
+        )
+        await session.execute(
+            update(Users)
+            .where(Users.id == follower_id)
+            .values(follower_count=Users.follower_count + delta)
+        )
+
+    @classmethod
+    async def change_follow_counts_many(
+        cls, session: AsyncSession, user_id: int, follower_ids: Set[int], delta: int
+    ) -> None:
+        if not follower_ids:
+            return
+        await session.execute(
+            update(Users)
+            .where(Users.id == user_id)
+            .values(following_count=Users.following_count + delta * len(follower_ids))
+        )
+        await session.execute(
+            update(Users)
+            .where(Users.id.in_(follower_ids))
+            .values(follower_count=Users.follower_count + delta)
+        )
+
+    @classmethod
+    async def get_existing_ids(
+        cls, session: AsyncSession, id_lst: Set[int]
+    ) -> Set[int]:
+        if not id_lst:
+            return set()
+        users_ids = await session.execute(select(Users.id).where(Users.id.in_(id_lst)))
+        return set(users_ids.scalars())
+
+    @classmethod
+    async def get_users_ids(cls, session: AsyncSession) -> List[int]:
+        users_ids = await session.execute(select(Users.id).order_by(Users.id))
+        users_ids = users_ids.scalars().all()
+        return users_ids
 
     @classmethod
-    async def get_user_by_id(cls, user_id: int) -> Users:
-        user = await session.execute(select(Users).where(Users.id == user_id))
-        user = user.scalars().first()
-        return user
+    @replica_read
+    async def get_profile(cls, session: AsyncSession, user_id: int) -> Optional[dict]:
+        user = await session.execute(
+            select(
+                Users.id, Users.name, Users.follower_count, Users.following_count
+            ).where(Users.id == user_id)
+        )
+        user = user.first()
+        return dict(user._mapping) if user else None
+
+    @classmethod
+    @replica_read
+    async def get_users_short(
+        cls, session: AsyncSession, id_lst: List[int]
+    ) -> Dict[int, dict]:
+        users = await session.execute(
+            select(Users.id, Users.name).where(Users.id.in_(id_lst))
+        )
+        users = {user.id: {"id": user.id, "name": user.name} for user in users}
+        return users
 
 
 class TweetService:
     @classmethod
-    async def get_tweet(cls, id: int) -> Tweets:
-        tweet = await session.execute(select(Tweets).where(Tweets.id == id))
+    def feed_options(cls, with_likes: bool = True) -> list:
+        likes = selectinload(Tweets.likes) if with_likes else noload(Tweets.likes)
+        return [selectinload(Tweets.attachments), likes]
+
+    @classmethod
+    def feed_query(
+        cls,
+        user_id: int,
+        cursor: Optional[Tuple[datetime, int]],
+        *columns,
+    ):
+        query = (
+            select(*columns)
+            .join(Followers, Followers.user_id == user_id)
+            .where(Tweets.author == Followers.follower_id, Tweets.deleted_at.is_(None))
+        )
+        if cursor is not None:
+            created_at, id = cursor
+            query = query.where(
+                or_(
+                    Tweets.created_at < created_at,
+                    and_(Tweets.created_at == created_at, Tweets.id < id),
+                )
+            )
+        return query.order_by(Tweets.created_at.desc(), Tweets.id.desc())
+
+    @classmethod
+    async def get_tweet(cls, session: AsyncSession, id: int) -> Tweets:
+        # callers only check the tweet itself, likes of a popular tweet are
+        # far too many to load along with it
+        tweet = await session.execute(
+            select(Tweets)
+            .where(Tweets.id == id, Tweets.deleted_at.is_(None))
+            .options(noload(Tweets.likes), noload(Tweets.attachments))
+        )
         tweet = tweet.scalars().first()
         return tweet
 
     @classmethod
-    async def get_tweet_lst(cls, user_id: int) -> List[Tweets]:
+    @replica_read
+    async def get_feed_versions(
+        cls,
+        session: AsyncSession,
+        user_id: int,
+        limit: int,
+        cursor: Optional[Tuple[datetime, int]] = None,
+    ) -> List[Tuple[int, int]]:
+        versions = await session.execute(
+            cls.feed_query(user_id, cursor, Tweets.id, Tweets.likes_version).limit(
+                limit
+            )
+        )
+        return [tuple(version) for version in versions]
+
+    @classmethod
+    @replica_read
+    async def get_versions_by_ids(
+        cls, session: AsyncSession, id_lst: List[int]
+    ) -> List[Tuple[int, int]]:
+        versions = await session.execute(
+            select(Tweets.id, Tweets.likes_version).where(
+                Tweets.id.in_(id_lst), Tweets.deleted_at.is_(None)
+            )
+        )
+        versions = dict(versions.all())
+        return [(id, versions[id]) for id in id_lst if id in versions]
+
+    @classmethod
+    @replica_read
+    async def get_tweets_by_ids(
+        cls, session: AsyncSession, id_lst: List[int], with_likes: bool = True
+    ) -> List[Tweets]:
         tweets_list = await session.execute(
             select(Tweets)
-            .join(Users, Tweets.author == Users.id)
-            .join(Followers, Followers.user_id == user_id)
-            .where(Tweets.author == Followers.follower_id)
-            .options(selectinload(Tweets.attachments), selectinload(Tweets.likes))
+            .where(Tweets.id.in_(id_lst), Tweets.deleted_at.is_(None))
+            .options(*cls.feed_options(with_likes))
+        )
+        tweets = {tweet.id: tweet for tweet in tweets_list.unique().scalars().all()}
+        return [tweets[id] for id in id_lst if id in tweets]
+
+    @classmethod
+    @replica_read
+    async def get_timeline_entries(
+        cls, session: AsyncSession, user_id: int, limit: int
+    ) -> List[Tuple[datetime, int]]:
+        entries = await session.execute(
+            cls.feed_query(user_id, None, Tweets.created_at, Tweets.id).limit(limit)
+        )
+        return [tuple(entry) for entry in entries]
+
+    @classmethod
+    async def change_like_count(
+        cls, session: AsyncSession, tweet_id: int, delta: int
+    ) -> Optional[int]:
+        """Return the author of the tweet, None if there is no such tweet."""
+        author = await session.execute(
+            update(Tweets)
+            .where(Tweets.id == tweet_id)
+            .values(
+                like_count=Tweets.like_count + delta,
+                likes_version=Tweets.likes_version + 1,
+            )
+            .returning(Tweets.author)
+        )
+        return author.scalar()
+
+    @classmethod
+    async def change_like_counts(
+        cls, session: AsyncSession, tweet_ids: Set[int], delta: int
+    ) -> Dict[int, int]:
+        """Return the author of each changed tweet."""
+        if not tweet_ids:
+            return {}
+        authors = await session.execute(
+            update(Tweets)
+            .where(Tweets.id.in_(tweet_ids))
+            .values(
+                like_count=Tweets.like_count + delta,
+                likes_version=Tweets.likes_version + 1,
+            )
+            .returning(Tweets.id, Tweets.author)
+        )
+        return dict(authors.all())
+
+    @classmethod
+    async def get_existing_ids(
+        cls, session: AsyncSession, id_lst: Set[int]
+    ) -> Set[int]:
+        if not id_lst:
+            return set()
+        tweets_ids = await session.execute(
+            select(Tweets.id).where(Tweets.id.in_(id_lst), Tweets.deleted_at.is_(None))
+        )
+        return set(tweets_ids.scalars())
+
+    @classmethod
+    async def soft_delete(cls, session: AsyncSession, id: int, author: int) -> bool:
+        deleted = await session.execute(
+            update(Tweets)
+            .where(
+                Tweets.id == id, Tweets.author == author, Tweets.deleted_at.is_(None)
+            )
+            .values(deleted_at=datetime.utcnow())
+            .returning(Tweets.id)
+        )
+        return deleted.first() is not None
+
+    @classmethod
+    async def get_deleted_ids(cls, session: AsyncSession, limit: int) -> List[int]:
+        tweets_ids = await session.execute(
+            select(Tweets.id)
+            .where(Tweets.deleted_at.is_not(None))
+            .order_by(Tweets.deleted_at)
+            .limit(limit)
+        )
+        return tweets_ids.scalars().all()
+
+    @classmethod
+    async def purge_tweet(cls, session: AsyncSession, id: int) -> None:
+        await session.execute(
+            delete(Tweets).where(Tweets.id == id, Tweets.deleted_at.is_not(None))
         )
-        tweets_list = tweets_list.unique().scalars().all()
-        return tweets_list
 
 
 class MediaService:
     @classmethod
-    async def get_media_lst(cls, id_lst: List[int]) -> List[Media]:
+    async def get_media_lst(
+        cls, session: AsyncSession, id_lst: List[int]
+    ) -> List[Media]:
         media_objects = await session.execute(select(Media).where(Media.id.in_(id_lst)))
         media_list = media_objects.scalars().all()
         return media_list
 
+    @classmethod
+    async def delete_tweet_media(
+        cls, session: AsyncSession, tweet_id: int
+    ) -> List[Tuple[int, Optional[str], Optional[str]]]:
+        """Delete the media of a tweet and return their id, extension and blob."""
+        deleted = await session.execute(
+            delete(Media)
+            .where(Media.tweet_id == tweet_id)
+            .returning(Media.id, Media.extension, Media.blob)
+        )
+        return [tuple(media) for media in deleted]
+
+    @classmethod
+    async def acquire_blob(cls, session: AsyncSession, name: str, size: int) -> None:
+        now = datetime.utcnow()
+        insert = dialect_insert(session, MediaBlobs).values(
+            name=name, size=size, ref_count=1, updated_at=now
+        )
+        await session.execute(
+            insert.on_conflict_do_update(
+                index_elements=[MediaBlobs.name],
+                set_={"ref_count": MediaBlobs.ref_count + 1, "updated_at": now},
+            )
+        )
+
+    @classmethod
+    async def release_blobs(cls, session: AsyncSession, names: List[str]) -> None:
+        now = datetime.utcnow()
+        for name, count in Counter(names).items():
+            await session.execute(
+                update(MediaBlobs)
+                .where(MediaBlobs.name == name)
+                .values(ref_count=MediaBlobs.ref_count - count, updated_at=now)
+            )
+
+    @classmethod
+    async def get_released_blobs(
+        cls, session: AsyncSession, released_before: datetime, limit: int
+    ) -> List[str]:
+        names = await session.execute(
+            select(MediaBlobs.name)
+            .where(MediaBlobs.ref_count <= 0, MediaBlobs.updated_at < released_before)
+            .limit(limit)
+        )
+        names = names.scalars().all()
+        return names
+
+    @classmethod
+    async def delete_released_blob(cls, session: AsyncSession, name: str) -> bool:
+        result = await session.execute(
+            delete(MediaBlobs).where(MediaBlobs.name == name, MediaBlobs.ref_count <= 0)
+        )
+        return result.rowcount > 0
+
 
 class LikesService:
     @classmethod
-    async def get_like(cls, tweet_id: int, user_id: int) -> Likes:
-        like = await session.execute(
-            select(Likes).where(Likes.tweet_id == tweet_id, Likes.user_id == user_id)
+    async def add_like(cls, session: AsyncSession, tweet_id: int, user_id: int) -> bool:
+        return tweet_id in await cls.add_likes(session, [tweet_id], user_id)
+
+    @classmethod
+    async def add_likes(
+        cls, session: AsyncSession, tweet_ids: List[int], user_id: int
+    ) -> Set[int]:
+        """Like every tweet of ``tweet_ids`` and return the ones newly liked.
+
+        Selecting the tweets makes a missing tweet look like an existing like,
+        callers tell the two apart only for the ids that were not returned.
+        """
+        if not tweet_ids:
+            return set()
+        insert = dialect_insert(session, Likes).from_select(
+            [Likes.tweet_id, Likes.user_id],
+            select(Tweets.id, literal(user_id)).where(
+                Tweets.id.in_(tweet_ids), Tweets.deleted_at.is_(None)
+            ),
+        )
+        inserted = await session.execute(
+            insert.on_conflict_do_nothing().returning(Likes.tweet_id)
+        )
+        return set(inserted.scalars())
+
+    @classmethod
+    async def remove_like(
+        cls, session: AsyncSession, tweet_id: int, user_id: int
+    ) -> bool:
+        return tweet_id in await cls.remove_likes(session, [tweet_id], user_id)
+
+    @classmethod
+    async def remove_likes(
+        cls, session: AsyncSession, tweet_ids: List[int], user_id: int
+    ) -> Set[int]:
+        if not tweet_ids:
+            return set()
+        deleted = await session.execute(
+            delete(Likes)
+            .where(Likes.tweet_id.in_(tweet_ids), Likes.user_id == user_id)
+            .returning(Likes.tweet_id)
+        )
+        return set(deleted.scalars())
+
+    @classmethod
+    async def delete_likes_chunk(
+        cls, session: AsyncSession, tweet_id: int, limit: int
+    ) -> int:
+        chunk = (
+            select(Likes.user_id).where(Likes.tweet_id == tweet_id).limit(limit)
+        ).scalar_subquery()
+        deleted = await session.execute(
+            delete(Likes).where(Likes.tweet_id == tweet_id, Likes.user_id.in_(chunk))
+        )
+        return deleted.rowcount
+
+    @classmethod
+    @replica_read
+    async def get_likers_preview(
+        cls, session: AsyncSession, tweet_ids: List[int], limit: int
+    ) -> Dict[int, List[int]]:
+        rank = (
+            func.row_number()
+            .over(partition_by=Likes.tweet_id, order_by=Likes.user_id)
+            .label("rank")
+        )
+        likes = (
+            select(Likes.tweet_id, Likes.user_id, rank)
+            .where(Likes.tweet_id.in_(tweet_ids))
+            .subquery()
+        )
+        likes = await session.execute(
+            select(likes.c.tweet_id, likes.c.user_id)
+            .where(likes.c.rank <= limit)
+            .order_by(likes.c.tweet_id, likes.c.rank)
         )
-        like = like.scalars().first()
-        return like
+        likers = {tweet_id: [] for tweet_id in tweet_ids}
+        for tweet_id, user_id in likes:
+            likers[tweet_id].append(user_id)
+        return likers
 
 
 class FollowersService:
     @classmethod
-    async def get_follow(cls, user_id: int, follower_id: int) -> Followers:
-        follow = await session.execute(
-            select(Followers).where(
-                Followers.user_id == user_id, Followers.follower_id == follower_id
+    async def add_follow(
+        cls, session: AsyncSession, user_id: int, follower_id: int
+    ) -> bool:
+        return follower_id in await cls.add_follows(session, user_id, [follower_id])
+
+    @classmethod
+    async def add_follows(
+        cls, session: AsyncSession, user_id: int, follower_ids: List[int]
+    ) -> Set[int]:
+        """Follow every user of ``follower_ids`` and return the ones newly followed.
+
+        As with likes, a missing user is indistinguishable from an existing
+        follow here.
+        """
+        if not follower_ids:
+            return set()
+        insert = dialect_insert(session, Followers).from_select(
+            [Followers.user_id, Followers.follower_id],
+            select(literal(user_id), Users.id).where(Users.id.in_(follower_ids)),
+        )
+        inserted = await session.execute(
+            insert.on_conflict_do_nothing().returning(Followers.follower_id)
+        )
+        return set(inserted.scalars())
+
+    @classmethod
+    async def remove_follow(
+        cls, session: AsyncSession, user_id: int, follower_id: int
+    ) -> bool:
+        return follower_id in await cls.remove_follows(session, user_id, [follower_id])
+
+    @classmethod
+    async def remove_follows(
+        cls, session: AsyncSession, user_id: int, follower_ids: List[int]
+    ) -> Set[int]:
+        if not follower_ids:
+            return set()
+        deleted = await session.execute(
+            delete(Followers)
+            .where(
+                Followers.user_id == user_id, Followers.follower_id.in_(follower_ids)
             )
+            .returning(Followers.follower_id)
+        )
+        return set(deleted.scalars())
+
+    @classmethod
+    async def get_followers_ids(cls, session: AsyncSession, user_id: int) -> List[int]:
+        followers_ids = await session.execute(
+            select(Followers.user_id).where(Followers.follower_id == user_id)
         )
-        follow = follow.scalars().first()
-        return follow
+        followers_ids = followers_ids.scalars().all()
+        return followers_ids
 
     @classmethod
-    async def get_followers_lst(cls, user_id: int) -> List[Users]:
-        followers_list = await session.execute(
-            select(Users)
+    async def get_following_ids(cls, session: AsyncSession, user_id: int) -> List[int]:
+        following_ids = await session.execute(
+            select(Followers.follower_id).where(Followers.user_id == user_id)
+        )
+        following_ids = following_ids.scalars().all()
+        return following_ids
+
+    @classmethod
+    @replica_read
+    async def get_followers_page(
+        cls,
+        session: AsyncSession,
+        user_id: int,
+        limit: int,
+        after: Optional[int] = None,
+    ) -> List[dict]:
+        query = (
+            select(Users.id, Users.name)
             .join(Followers, Followers.user_id == Users.id)
             .where(Followers.follower_id == user_id)
         )
-        followers_list = followers_list.scalars().all()
-        return followers_list
+        if after is not None:
+            query = query.where(Followers.user_id > after)
+        followers = await session.execute(
+            query.order_by(Followers.user_id).limit(limit)
+        )
+        return [{"id": user.id, "name": user.name} for user in followers]
 
     @classmethod
-    async def get_following_lst(cls, user_id: int) -> List[Users]:
-        following_list = await session.execute(
-            select(Users)
+    @replica_read
+    async def get_following_page(
+        cls,
+        session: AsyncSession,
+        user_id: int,
+        limit: int,
+        after: Optional[int] = None,
+    ) -> List[dict]:
+        query = (
+            select(Users.id, Users.name)
             .join(Followers, Followers.follower_id == Users.id)
             .where(Followers.user_id == user_id)
         )
-        following_list = following_list.scalars().all()
-        return following_list
+        if after is not None:
+            query = query.where(Followers.follower_id > after)
+        following = await session.execute(
+            query.order_by(Followers.follower_id).limit(limit)
+        )
+        return [{"id": user.id, "name": user.name} for user in following]
@@ -0,0 +1,42 @@
+"""Conditional GET: ETag headers and 304 answers to a matching If-None-Match.
+
+The responses carry ``Cache-Control: no-cache``, so clients and nginx may
+keep them but have to revalidate every time; a revalidation that still
+matches costs a 304 without a body instead of the whole payload.
+"""
+
+import hashlib
+from http import HTTPStatus
+from typing import Optional
+
+from fastapi import Response
+
+CACHE_CONTROL = "no-cache"
+
+
+def make_etag(body: bytes) -> str:
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, and nginx turns the tags of the
+    # responses it compresses into weak ones
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def json_response(body: bytes, etag: str) -> Response:
+    return Response(body, media_type="application/json", headers=etag_headers(etag))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=etag_headers(etag))
@@ -0,0 +1,48 @@
+import os
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+
+# variant name -> (max width, output format); None keeps the source value
+VARIANTS: Dict[str, Tuple[Optional[int], Optional[str]]] = {
+    "w320": (320, None),
+    "w640": (640, None),
+    "w1280": (1280, None),
+    "full": (None, "webp"),
+}
+
+FORMATS = {
+    ".jpg": "JPEG",
+    ".jpeg": "JPEG",
+    ".png": "PNG",
+    ".gif": "GIF",
+    ".webp": "WEBP",
+}
+
+
+def variant_filename(variant: str, extension: str) -> str:
+    _, output_format = VARIANTS[variant]
+    return f"{variant}.{output_format}" if output_format else f"{variant}{extension}"
+
+
+def render_variants(source: str, target_dir: str, extension: str) -> None:
+    """Write every variant of ``source`` into ``target_dir``.
+
+    Runs in a worker process, so it only depends on Pillow and the standard
+    library. Files are written under a temporary name and renamed into place.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    with Image.open(source) as image:
+        image.load()
+        for variant, (width, output_format) in VARIANTS.items():
+            output_format = (output_format or FORMATS[extension]).upper()
+            resized = image
+            if width and image.width > width:
+                resized = image.copy()
+                resized.thumbnail((width, image.height))
+            if output_format == "JPEG" and resized.mode not in ("RGB", "L"):
+                resized = resized.convert("RGB")
+            target = os.path.join(target_dir, variant_filename(variant, extension))
+            tmp_target = f"{target}.{os.getpid()}.tmp"
+            resized.save(tmp_target, format=output_format)
+            os.replace(tmp_target, target)
@@ -1,8 +1,12 @@
-from aiologger import Logger
-from aiologger.handlers.files import AsyncFileHandler
-from aiologger.formatters.base import Formatter
-from dotenv import load_dotenv
+import asyncio
+import json
+import logging
 import os
+import sys
+import time
+from typing import Optional
+
+from dotenv import load_dotenv
 
 load_dotenv()
 
@@ -10,14 +14,157 @@ if os.environ.get("ENV") == "test":
     LOG_FILE = os.getenv('LOG_FILE_TESTS')
 else:
     LOG_FILE = os.getenv('LOG_FILE')
+ACCESS_LOG_FILE = os.getenv(
+    "ACCESS_LOG_FILE", os.path.join(os.path.dirname(LOG_FILE or ""), "access.log")
+)
+
+# with several workers each process appends to its own app.<pid>.log instead
+# of interleaving writes to one shared file
+LOG_PER_PROCESS = os.getenv("LOG_PER_PROCESS", "false").lower() == "true"
+LOG_LEVEL = logging.getLevelName(os.getenv("LOG_LEVEL", "DEBUG").upper())
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", 512))
+LOG_FORMAT = "%(name)s - %(module)s - %(funcName)s - %(asctime)s - %(levelname)s: %(message)s"
+
+# reports failures of the batch loggers themselves, to stderr by default
+fallback_logger = logging.getLogger(__name__)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record whose message is a dict as one JSON line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(
+            {"time": self.formatTime(record), **record.msg}, default=str
+        )
+
+
+class BatchLogger:
+    """Logger that never waits for the disk on the calling coroutine.
+
+    Calls below the level return immediately, without formatting anything.
+    Enabled calls only capture the caller and the raw arguments into a
+    bounded queue; one writer task formats them and appends whole batches
+    to the file. When the queue is full the message is dropped and counted
+    instead of slowing the caller down; so is a batch that fails to write.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        filename: str,
+        level: int = LOG_LEVEL,
+        queue_size: int = LOG_QUEUE_SIZE,
+        batch_size: int = LOG_BATCH_SIZE,
+        formatter: Optional[logging.Formatter] = None,
+    ):
+        self.name = name
+        self.filename = filename
+        self.level = level
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.written = 0
+        self.formatter = formatter or logging.Formatter(LOG_FORMAT)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._file = None
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        self._file = open(self.filename, "a", encoding="utf-8")
+        self._writer = asyncio.create_task(self._write_batches())
+
+    def _log(self, level: int, msg: str, args: tuple) -> None:
+        if level < self.level:
+            return
+        # 0 is this method, 1 the public level method, 2 its caller
+        frame = sys._getframe(2)
+        code = frame.f_code
+        item = (level, msg, args, time.time(), code.co_filename, frame.f_lineno, code.co_name)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def log(self, level: int, msg, *args) -> None:
+        self._log(level, msg, args)
+
+    def debug(self, msg: str, *args) -> None:
+        self._log(logging.DEBUG, msg, args)
+
+    def info(self, msg: str, *args) -> None:
+        self._log(logging.INFO, msg, args)
+
+    def warning(self, msg: str, *args) -> None:
+        self._log(logging.WARNING, msg, args)
+
+    def error(self, msg: str, *args) -> None:
+        self._log(logging.ERROR, msg, args)
+
+    def _format(self, item) -> str:
+        level, msg, args, created, pathname, lineno, func = item
+        record = logging.LogRecord(
+            self.name, level, pathname, lineno, msg, args, None, func=func
+        )
+        record.created = created
+        record.msecs = (created - int(created)) * 1000
+        return self.formatter.format(record) + "\n"
+
+    def _write(self, data: str) -> None:
+        self._file.write(data)
+        self._file.flush()
+
+    async def _write_batches(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+            try:
+                data = "".join(self._format(item) for item in batch)
+                await asyncio.to_thread(self._write, data)
+                self.written += len(batch)
+            except Exception:
+                self.dropped += len(batch)
+                fallback_logger.exception(
+                    "Failed to write %s lines to %s", len(batch), self.filename
+                )
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def shutdown(self) -> None:
+        if self._writer is not None:
+            await self._queue.join()
+            self._writer.cancel()
+            self._writer = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def process_log_file(filename: str) -> str:
+    if not LOG_PER_PROCESS:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{os.getpid()}{ext}"
 
 
 async def get_logger():
-    logger = Logger(name='app_logger')
+    logger = BatchLogger(name='app_logger', filename=process_log_file(LOG_FILE))
+    logger.start()
+
+    return logger
+
 
-    file_handler = AsyncFileHandler(filename=LOG_FILE)
-    formatter = Formatter(fmt="%(name)s - %(module)s - %(funcName)s - %(asctime)s - %(levelname)s: %(message)s")
-    file_handler.formatter = formatter
-    logger.add_handler(file_handler)
+async def get_access_logger():
+    logger = BatchLogger(
+        name='access_logger',
+        filename=process_log_file(ACCESS_LOG_FILE),
+        formatter=JsonFormatter(),
+    )
+    logger.start()
 
     return logger
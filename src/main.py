@@ -1,20 +1,101 @@
+import asyncio
+import logging
 import os
+import re
+import signal
+import time
+from collections import defaultdict
 
+# a worker's boot is dominated by the imports below, so the startup budget
+# is measured from here rather than from the startup hook
+IMPORT_STARTED = time.perf_counter()
+
+import orjson
 from dotenv import load_dotenv
-from fastapi import FastAPI, Path, UploadFile, Depends, Request
-from typing import Annotated, Union
+from fastapi import FastAPI, Path, Query, UploadFile, Depends, Request
+from typing import Annotated, Dict, Set, Tuple, Union
 from fastapi import HTTPException, Header
 from http import HTTPStatus
-from fastapi.responses import JSONResponse
-from pathlib import Path as Path_l
-from aiofiles import open as aio_open
+from starlette.datastructures import Headers
+from fastapi.responses import (
+    JSONResponse,
+    FileResponse,
+    PlainTextResponse,
+    ORJSONResponse,
+)
+from sqlalchemy.ext.asyncio import AsyncSession
 
 load_dotenv()
 
-from src.database import engine, session
-from src.models import Base, Tweets, Media, Users, Followers, Likes
-from src.schemas import TweetPost, TweetAnswer, PostAnswer, Answer, UserAnswer, MediaAnswer
-from src.logging_config import get_logger
+from src.database import engine, async_session, get_session, replica_engines
+from src.models import Base, Tweets, Media, Users
+from src.schemas import (
+    TweetPost,
+    TweetAnswer,
+    PostAnswer,
+    Answer,
+    UserAnswer,
+    UserListAnswer,
+    MediaAnswer,
+    LikesBatch,
+    LikesBatchAnswer,
+    FollowsBatch,
+    FollowsBatchAnswer,
+)
+from src.logging_config import get_logger, get_access_logger
+from src.request_stats import start_request, set_request_user
+from src.auth import Principal, auth_cache
+from src.etags import (
+    etag_headers,
+    etag_matches,
+    json_response,
+    make_etag,
+    not_modified,
+)
+from src.profile_cache import profile_cache, invalidate_profiles
+from src.tweet_stream import EventStreamResponse, tweet_stream
+from src.metrics import metrics, render, METRICS_FLUSH_INTERVAL
+from src.serialization import feed_payload, tweet_payload, user_page_payload
+from src.media_storage import (
+    MEDIA_SWEEP_INTERVAL,
+    MediaTooLarge,
+    exceeds_max_size,
+    safe_extension,
+    blob_path,
+    stage_upload,
+    publish_upload,
+    discard_upload,
+    sweep_blobs,
+    blob_extension,
+    variants_dir,
+    ensure_variants,
+    schedule_variants,
+    shutdown_variant_pool,
+)
+from src.imaging import VARIANTS, variant_filename
+from src.pagination import (
+    CursorError,
+    decode_cursor,
+    encode_cursor,
+    decode_id_cursor,
+    encode_id_cursor,
+)
+from src.timeline import (
+    TIMELINE_FANOUT,
+    timeline_store,
+    rebuild_requested,
+    rebuild_stored_timelines,
+    request_rebuild,
+    get_timeline_versions,
+    fan_out_tweet,
+    remove_tweet,
+)
+from src.tweet_purge import (
+    TWEET_PURGE_INTERVAL,
+    purge_deleted_tweets,
+    purge_requested,
+    request_purge,
+)
 from src.db_services import (
     UserService,
     TweetService,
@@ -25,176 +106,469 @@ from src.db_services import (
 
 app = FastAPI()
 logger = None
+access_logger = None
+blob_sweeper = None
+metrics_flusher = None
+tweet_purger = None
+timeline_rebuilder = None
+
+PROFILE_LIST_LIMIT = 100
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", 100))
+# python -m src.serve migrates once before the workers start and turns this off
+DB_CREATE_ALL = os.getenv("DB_CREATE_ALL", "true").lower() == "true"
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", 3))
+BLOB_NAME_RE = re.compile(r"^[0-9a-f]{64}(\.[A-Za-z0-9]{1,10})?$")
+# room for the multipart boundaries and part headers around the file itself
+UPLOAD_OVERHEAD = 16 * 1024
 
 
 async def initialize_logger():
-    global logger
+    global logger, access_logger
     logger = await get_logger()
+    access_logger = await get_access_logger()
 
 
 async def shutdown_logger():
     await logger.shutdown()
+    await access_logger.shutdown()
 
 
 @app.on_event("startup")
 async def startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    if DB_CREATE_ALL:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
     await initialize_logger()
+    global blob_sweeper, metrics_flusher, tweet_purger
+    blob_sweeper = asyncio.create_task(sweep_media_blobs())
+    tweet_purger = asyncio.create_task(purge_tweets())
+    metrics_flusher = asyncio.create_task(flush_metrics())
+    if TIMELINE_FANOUT:
+        start_timeline_rebuilds()
+    elapsed = time.perf_counter() - IMPORT_STARTED
+    if elapsed > STARTUP_BUDGET:
+        logger.warning(
+            "Worker %s started in %.2fs, over the %.2fs budget",
+            os.getpid(),
+            elapsed,
+            STARTUP_BUDGET,
+        )
+    else:
+        logger.info("Worker %s started in %.2fs", os.getpid(), elapsed)
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await session.close()
+    tweet_stream.close_all()
+    blob_sweeper.cancel()
+    tweet_purger.cancel()
+    metrics_flusher.cancel()
+    if TIMELINE_FANOUT:
+        stop_timeline_rebuilds()
+    metrics.remove_snapshot()
+    shutdown_variant_pool()
     await engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
     await shutdown_logger()
 
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    response = await call_next(request)
-    await logger.info(f"{request.method} {request.url} - {response.status_code}")
-    return response
-
-
-async def token_required(api_key: Annotated[Union[str, None], Header()] = None):
+async def sweep_media_blobs():
+    while True:
+        await asyncio.sleep(MEDIA_SWEEP_INTERVAL)
+        try:
+            async with async_session() as session:
+                removed = await sweep_blobs(session)
+            logger.debug("Media sweeper removed %s blobs", removed)
+        except Exception as exc:
+            logger.error("Media sweeper failed: %s", exc)
+
+
+async def purge_tweets():
+    while True:
+        try:
+            await asyncio.wait_for(purge_requested.wait(), TWEET_PURGE_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        purge_requested.clear()
+        try:
+            async with async_session() as session:
+                purged = await purge_deleted_tweets(session)
+            logger.debug("Tweet purger removed %s tweets", purged)
+        except Exception as exc:
+            logger.error("Tweet purger failed: %s", exc)
+
+
+async def rebuild_timelines_on_request():
+    while True:
+        await rebuild_requested.wait()
+        rebuild_requested.clear()
+        try:
+            async with async_session() as session:
+                rebuilt = await rebuild_stored_timelines(session)
+            logger.info("Rebuilt %s timelines", rebuilt)
+        except Exception as exc:
+            logger.error("Timeline rebuild failed: %s", exc)
+
+
+def start_timeline_rebuilds():
+    # kill -HUP <pid> regenerates the timelines of the running worker
+    global timeline_rebuilder
+    timeline_rebuilder = asyncio.create_task(rebuild_timelines_on_request())
+    asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, request_rebuild)
+
+
+def stop_timeline_rebuilds():
+    asyncio.get_running_loop().remove_signal_handler(signal.SIGHUP)
+    timeline_rebuilder.cancel()
+
+
+async def flush_metrics():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            await asyncio.to_thread(metrics.flush)
+        except Exception as exc:
+            logger.error("Metrics flush failed: %s", exc)
+
+
+def collect_runtime_metrics():
+    pool = engine.pool
+    yield "db_pool_checked_out", (), pool.checkedout()
+    yield "db_pool_overflow", (), max(pool.overflow(), 0)
+    yield "auth_cache_hits_total", (), auth_cache.hits
+    yield "auth_cache_misses_total", (), auth_cache.misses
+    yield "auth_cache_size", (), len(auth_cache)
+    yield "stream_connections", (), len(tweet_stream)
+    yield "stream_events_total", (), tweet_stream.published
+    yield "stream_slow_disconnects_total", (), tweet_stream.slow_disconnects
+    yield "profile_cache_hits_total", (), profile_cache.hits
+    yield "profile_cache_misses_total", (), profile_cache.misses
+    yield "profile_cache_size", (), len(profile_cache)
+    yield "profile_cache_invalidations_total", (), profile_cache.invalidations
+    yield (
+        "profile_cache_invalidation_seconds_total",
+        (),
+        profile_cache.invalidation_seconds,
+    )
+    if logger is not None:
+        yield "log_dropped_total", (), logger.dropped + access_logger.dropped
+
+
+metrics.register_collector(collect_runtime_metrics)
+
+
+class LimitUploadSize:
+    """Rejects uploads as soon as they are known to be over the limit.
+
+    That is before the app runs when Content-Length says so, and otherwise
+    as soon as the body read so far passes it: a chunked upload would
+    only be checked after the whole form had been parsed and spooled.
+
+    A plain ASGI middleware: BaseHTTPMiddleware runs every request in an
+    extra task with its own streams, which held tens of kilobytes for each
+    open event stream.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/api/medias":
+            await self.app(scope, receive, send)
+            return
+        content_length = Headers(scope=scope).get("content-length")
+        if (
+                content_length is not None
+                and content_length.isdigit()
+                and exceeds_max_size(int(content_length) - UPLOAD_OVERHEAD)
+        ):
+            await self.too_large(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+
+        async def receive_limited():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if exceeds_max_size(received - UPLOAD_OVERHEAD):
+                    # the rest of the body is never read; the app fails to
+                    # parse the form and its answer is replaced below
+                    exceeded = True
+                    raise MediaTooLarge("Upload body is over the limit")
+            return message
+
+        rejected = False
+
+        async def send_limited(message):
+            nonlocal rejected
+            if not exceeded:
+                await send(message)
+            elif not rejected:
+                rejected = True
+                await self.too_large(scope, receive, send)
+
+        try:
+            await self.app(scope, receive_limited, send_limited)
+        except MediaTooLarge:
+            if not rejected:
+                await self.too_large(scope, receive, send)
+
+    @staticmethod
+    async def too_large(scope, receive, send):
+        response = JSONResponse(
+            status_code=HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+            content={"error": "Sorry. The file is too large."},
+        )
+        await response(scope, receive, send)
+
+
+class LogRequests:
+    """Records metrics and the access log line when the response starts."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = start_request()
+
+        async def send_logged(message):
+            if message["type"] == "http.response.start":
+                log_request(scope, message, stats)
+            await send(message)
+
+        await self.app(scope, receive, send_logged)
+
+
+def log_request(scope, message, stats) -> None:
+    request = Request(scope)
+    status = message["status"]
+    route = scope.get("route")
+    metrics.observe_request(
+        request.method,
+        route.path if route is not None else "<unmatched>",
+        status,
+        stats.elapsed,
+    )
+    logger.info("%s %s - %s", request.method, request.url, status)
+    content_length = Headers(raw=message["headers"]).get("content-length")
+    access_logger.log(
+        logging.INFO,
+        {
+            "method": request.method,
+            "path": request.url.path,
+            "status": status,
+            "latency_ms": round(stats.elapsed * 1000, 3),
+            "db_time_ms": round(stats.db_time * 1000, 3),
+            "db_queries": stats.query_count,
+            "user_id": stats.user_id,
+            "response_size": int(content_length) if content_length else None,
+        },
+    )
+
+
+# the middleware added last runs first
+app.add_middleware(LimitUploadSize)
+app.add_middleware(LogRequests)
+
+
+async def token_required(
+        api_key: Annotated[Union[str, None], Header()] = None,
+        session: AsyncSession = Depends(get_session),
+):
     if api_key is None:
-        await logger.warning("Authorization without api_key")
+        logger.warning("Authorization without api_key")
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="Valid api-key token is missing in headers",
         )
 
-    current_user = await UserService.get_user_api_key(api_key)
+    current_user = auth_cache.get(api_key)
+    if current_user is not None:
+        set_request_user(current_user.id)
+        return current_user
+
+    current_user = await UserService.get_user_api_key(session, api_key)
 
     if current_user is None:
-        await logger.warning("Authorization with invalid api_key")
+        logger.warning("Authorization with invalid api_key")
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="Sorry. Wrong api-key token in headers. This user does not exist.",
         )
+    auth_cache.set(api_key, current_user)
+    set_request_user(current_user.id)
     return current_user
 
 
-async def get_tweet(id: int = Path(title="Id of the tweet")):
-    tweet = await TweetService.get_tweet(id)
+async def get_tweet(
+        id: int = Path(title="Id of the tweet"),
+        session: AsyncSession = Depends(get_session),
+):
+    tweet = await TweetService.get_tweet(session, id)
     if tweet is None:
-        await logger.warning(f"Wrong request to database for tweet id = {id}")
+        logger.warning("Wrong request to database for tweet id = %s", id)
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST, detail="No such tweet in database."
         )
     return tweet
 
 
-@app.post(
-    "/api/tweets", dependencies=[Depends(token_required)], response_model=PostAnswer
-)
-async def tweet_post(tweet: TweetPost, current_user: Users = Depends(token_required)):
+@app.post("/api/tweets", response_model=PostAnswer)
+async def tweet_post(
+        tweet: TweetPost,
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
+):
     new_tweet = Tweets(author=current_user.id, content=tweet.tweet_data)
     if tweet.tweet_media_ids:
-        media_list = await MediaService.get_media_lst(tweet.tweet_media_ids)
+        media_list = await MediaService.get_media_lst(session, tweet.tweet_media_ids)
         new_tweet.attachments.extend(media_list)
     session.add(new_tweet)
     await session.commit()
-    await logger.debug(f"User {current_user} has posted tweet {tweet}")
+    tweet_stream.publish(
+        current_user.id, "tweet", {"id": new_tweet.id, "author": current_user.id}
+    )
+    if TIMELINE_FANOUT:
+        await fan_out_tweet(session, new_tweet)
+    logger.debug("User %s has posted tweet %s", current_user, tweet)
     return {"result": "true", "id": new_tweet.id}
 
 
 @app.post("/api/medias", response_model=MediaAnswer)
-async def media_post(file: UploadFile):
-    file_extension = Path_l(file.filename).suffix
-
-    new_media = Media(extension=file_extension)
-    session.add(new_media)
-    await session.commit()
-
-    file_path = Path_l("storage") / (str(new_media.id) + file_extension)
+async def media_post(file: UploadFile, session: AsyncSession = Depends(get_session)):
+    file_extension = safe_extension(file.filename)
 
-    if not file_path.parent.exists():
-        file_path.parent.mkdir(parents=True)
+    try:
+        staged = await stage_upload(file)
+    except MediaTooLarge:
+        raise HTTPException(
+            status_code=HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+            detail="Sorry. The file is too large.",
+        )
 
-    async with aio_open(file_path, "wb") as f:
-        contents = await file.read()
-        await f.write(contents)
-    await logger.debug(f"Media {new_media} has been created, directory:{file_path}")
+    blob_name = staged.sha256 + file_extension
+    try:
+        await MediaService.acquire_blob(session, blob_name, staged.size)
+        new_media = Media(extension=file_extension, blob=blob_name)
+        session.add(new_media)
+        await session.commit()
+    except BaseException:
+        await session.rollback()
+        discard_upload(staged.path)
+        raise
+    # published only once the reference is committed: a file without a
+    # committed blob row would never be found by the sweeper
+    try:
+        publish_upload(staged.path, blob_path(blob_name))
+    except Exception:
+        discard_upload(staged.path)
+        await session.delete(new_media)
+        await MediaService.release_blobs(session, [blob_name])
+        await session.commit()
+        raise
+    metrics.inc("media_upload_bytes_total", staged.size)
+    schedule_variants(blob_name)
+    logger.debug("Media %s has been created, blob:%s", new_media, blob_name)
 
     return {"result": "true", "media_id": new_media.id}
 
 
-@app.delete(
-    "/api/tweets/{id}",
-    dependencies=[Depends(token_required), Depends(get_tweet)],
-    response_model=Answer,
-)
+@app.get("/storage/variants/{shard}/{subshard}/{blob}/{filename}")
+async def media_variant(shard: str, subshard: str, blob: str, filename: str):
+    # nginx serves existing variants itself and only falls back here for
+    # the ones that have not been rendered yet
+    extension = blob_extension(blob)
+    filenames = {variant_filename(variant, extension) for variant in VARIANTS}
+    if (
+        not BLOB_NAME_RE.match(blob)
+        or (shard, subshard) != (blob[:2], blob[2:4])
+        or filename not in filenames
+        or not await ensure_variants(blob)
+    ):
+        raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="No such media.")
+    return FileResponse(
+        variants_dir(blob) / filename,
+        headers={"Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
+@app.delete("/api/tweets/{id}", response_model=Answer)
 async def tweet_delete(
-        current_user: Users = Depends(token_required), tweet: Tweets = Depends(get_tweet)
+        id: int = Path(title="Id of the tweet"),
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
 ):
-    if tweet.author != current_user.id:
-        await logger.warning(f"User {current_user} tried to delete tweet {tweet} of {tweet.author}")
+    if not await TweetService.soft_delete(session, id, current_user.id):
+        tweet = await get_tweet(id, session)
+        logger.warning(
+            "User %s tried to delete tweet %s of %s", current_user, tweet, tweet.author
+        )
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="You cannot delete tweet of the other user.",
         )
-
-    await session.delete(tweet)
     await session.commit()
-    await logger.debug(f"User {current_user} has deleted tweet {tweet}")
+    tweet_stream.publish(current_user.id, "delete", {"id": id})
+    # likes and media are removed by the purger in the background
+    request_purge()
+    if TIMELINE_FANOUT:
+        await remove_tweet(session, current_user.id, id)
+    logger.debug("User %s has deleted tweet %s", current_user, id)
 
     return {"result": "true"}
 
 
-@app.post(
-    "/api/tweets/{id}/likes",
-    dependencies=[Depends(token_required), Depends(get_tweet)],
-    response_model=Answer,
-)
+@app.post("/api/tweets/{id}/likes", response_model=Answer)
 async def like_tweet(
         id: int = Path(title="Id of the tweet"),
-        current_user: Users = Depends(token_required),
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
 ):
-    like = await LikesService.get_like(id, current_user.id)
-    if like:
+    if not await LikesService.add_like(session, id, current_user.id):
+        await get_tweet(id, session)
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="You have already liked this tweet.",
         )
-    new_like = Likes(user_id=current_user.id, tweet_id=id)
-    session.add(new_like)
+    author = await TweetService.change_like_count(session, id, 1)
     await session.commit()
-    await logger.debug(f"User {current_user} has liked tweet id = {id}")
+    tweet_stream.publish(author, "likes", {"id": id, "delta": 1})
+    logger.debug("User %s has liked tweet id = %s", current_user, id)
 
     return {"result": "true"}
 
 
-@app.delete(
-    "/api/tweets/{id}/likes",
-    dependencies=[Depends(token_required), Depends(get_tweet)],
-    response_model=Answer,
-)
+@app.delete("/api/tweets/{id}/likes", response_model=Answer)
 async def delete_likeid(
         id: int = Path(title="Id of the tweet"),
-        current_user: Users = Depends(token_required),
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
 ):
-    like = await LikesService.get_like(id, current_user.id)
-    if not like:
+    if not await LikesService.remove_like(session, id, current_user.id):
+        await get_tweet(id, session)
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST, detail="You have not liked this tweet."
         )
-    await session.delete(like)
+    author = await TweetService.change_like_count(session, id, -1)
     await session.commit()
-    await logger.debug(f"User {current_user} has deleted liked for tweet id = {id}")
+    tweet_stream.publish(author, "likes", {"id": id, "delta": -1})
+    logger.debug("User %s has deleted liked for tweet id = %s", current_user, id)
 
     return {"result": "true"}
 
 
-@app.post(
-    "/api/users/{id}/follow",
-    dependencies=[Depends(token_required)],
-    response_model=Answer,
-)
+@app.post("/api/users/{id}/follow", response_model=Answer)
 async def follow(
         id: int = Path(title="Id of the user"),
-        current_user: Users = Depends(token_required),
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
 ):
     if current_user.id == id:
         raise HTTPException(
@@ -202,109 +576,359 @@ async def follow(
             detail="Sorry. You cannot follow yourself.",
         )
 
-    check_follow = await FollowersService.get_follow(current_user.id, id)
-    if check_follow:
+    if not await FollowersService.add_follow(session, current_user.id, id):
+        if await UserService.get_profile(session, id) is None:
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST, detail="No such user in database."
+            )
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="Sorry. You have been already following this user.",
         )
-    new_follow_record = Followers(user_id=current_user.id, follower_id=id)
-    session.add(new_follow_record)
+    await UserService.change_follow_counts(session, current_user.id, id, 1)
     await session.commit()
-    await logger.debug(f"User {current_user} has followed user id = {id}")
+    invalidate_profiles(current_user.id, id)
+    tweet_stream.follow(current_user.id, [id])
+    if TIMELINE_FANOUT:
+        await timeline_store.discard(current_user.id)
+    logger.debug("User %s has followed user id = %s", current_user, id)
 
     return {"result": "true"}
 
 
-@app.delete(
-    "/api/users/{id}/follow",
-    dependencies=[Depends(token_required)],
-    response_model=Answer,
-)
+@app.delete("/api/users/{id}/follow", response_model=Answer)
 async def unfollow(
         id: int = Path(title="Id of the user"),
-        current_user: Users = Depends(token_required),
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
 ):
-    check_follow = await FollowersService.get_follow(current_user.id, id)
-    if check_follow is None:
+    if not await FollowersService.remove_follow(session, current_user.id, id):
         raise HTTPException(
             status_code=HTTPStatus.BAD_REQUEST,
             detail="Sorry. You are not following this user.",
         )
-    await session.delete(check_follow)
+    await UserService.change_follow_counts(session, current_user.id, id, -1)
     await session.commit()
-    await logger.debug(f"User {current_user} has unfollowed user id = {id}")
+    invalidate_profiles(current_user.id, id)
+    tweet_stream.unfollow(current_user.id, [id])
+    if TIMELINE_FANOUT:
+        await timeline_store.discard(current_user.id)
+    logger.debug("User %s has unfollowed user id = %s", current_user, id)
 
     return {"result": "true"}
 
 
-@app.get(
-    "/api/tweets", dependencies=[Depends(token_required)], response_model=TweetAnswer
-)
-async def get_tweets(current_user: Users = Depends(token_required)):
-    await logger.debug(f"Get tweet for user {current_user}")
-    tweets_list = await TweetService.get_tweet_lst(current_user.id)
-    tweets = []
-    for tweet in tweets_list:
-        author = await UserService.get_user_by_id(tweet.author)
-        likes_u = []
-        for like in tweet.likes:
-            user_like = await UserService.get_user_by_id(like.user_id)
-            likes_u.append({"user_id": user_like.id, "name": user_like.name})
-
-        tweets.append(
-            {
-                "id": tweet.id,
-                "content": tweet.content,
-                "attachments": [
-                    attachment.to_json()["url"] for attachment in tweet.attachments
-                ],
-                "author": author.to_json(),
-                "likes": likes_u,
-            }
+def split_batch(operations: list, key: str) -> Tuple[list, Dict[str, Dict[int, dict]]]:
+    """Prepare one result per operation, grouped by action and target id.
+
+    Only the first operation on a target is applied, the repeated ones fail.
+    """
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail=f"Sorry. A batch can hold at most {BATCH_MAX_OPERATIONS} operations.",
+        )
+    results = []
+    pending = defaultdict(dict)
+    seen = set()
+    for operation in operations:
+        result = operation.model_dump()
+        results.append(result)
+        target = result[key]
+        if target in seen:
+            result.update(result=False, error="Duplicate operation in batch.")
+            continue
+        seen.add(target)
+        pending[operation.action][target] = result
+    return results, pending
+
+
+def fill_batch_results(
+        pending: Dict[int, dict],
+        applied: Set[int],
+        error: str,
+        existing: Union[Set[int], None] = None,
+        missing_error: Union[str, None] = None,
+):
+    for target, result in pending.items():
+        if target in applied:
+            result.update(result=True)
+        elif existing is None or target in existing:
+            result.update(result=False, error=error)
+        else:
+            result.update(result=False, error=missing_error)
+
+
+@app.post("/api/likes:batch", response_model=LikesBatchAnswer)
+async def like_tweets_batch(
+        batch: LikesBatch,
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
+):
+    results, pending = split_batch(batch.operations, "tweet_id")
+    likes, unlikes = pending["like"], pending["unlike"]
+    liked = await LikesService.add_likes(session, list(likes), current_user.id)
+    unliked = await LikesService.remove_likes(session, list(unlikes), current_user.id)
+    liked_authors = await TweetService.change_like_counts(session, liked, 1)
+    unliked_authors = await TweetService.change_like_counts(session, unliked, -1)
+    existing = await TweetService.get_existing_ids(
+        session, (likes.keys() - liked) | (unlikes.keys() - unliked)
+    )
+    await session.commit()
+    for delta, authors in ((1, liked_authors), (-1, unliked_authors)):
+        for tweet_id, author in authors.items():
+            tweet_stream.publish(author, "likes", {"id": tweet_id, "delta": delta})
+    missing = "No such tweet in database."
+    fill_batch_results(
+        likes, liked, "You have already liked this tweet.", existing, missing
+    )
+    fill_batch_results(
+        unlikes, unliked, "You have not liked this tweet.", existing, missing
+    )
+    logger.debug(
+        "User %s has liked %s and unliked %s tweets in a batch",
+        current_user,
+        len(liked),
+        len(unliked),
+    )
+
+    return {"result": "true", "results": results}
+
+
+@app.post("/api/follows:batch", response_model=FollowsBatchAnswer)
+async def follow_users_batch(
+        batch: FollowsBatch,
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
+):
+    results, pending = split_batch(batch.operations, "user_id")
+    follows, unfollows = pending["follow"], pending["unfollow"]
+    own = follows.pop(current_user.id, None)
+    if own is not None:
+        own.update(result=False, error="Sorry. You cannot follow yourself.")
+    followed = await FollowersService.add_follows(
+        session, current_user.id, list(follows)
+    )
+    unfollowed = await FollowersService.remove_follows(
+        session, current_user.id, list(unfollows)
+    )
+    await UserService.change_follow_counts_many(session, current_user.id, followed, 1)
+    await UserService.change_follow_counts_many(
+        session, current_user.id, unfollowed, -1
+    )
+    existing = await UserService.get_existing_ids(session, follows.keys() - followed)
+    await session.commit()
+    if followed or unfollowed:
+        invalidate_profiles(current_user.id, *followed, *unfollowed)
+        tweet_stream.follow(current_user.id, followed)
+        tweet_stream.unfollow(current_user.id, unfollowed)
+    if TIMELINE_FANOUT and (followed or unfollowed):
+        await timeline_store.discard(current_user.id)
+    fill_batch_results(
+        follows,
+        followed,
+        "Sorry. You have been already following this user.",
+        existing,
+        "No such user in database.",
+    )
+    fill_batch_results(
+        unfollows, unfollowed, "Sorry. You are not following this user."
+    )
+    logger.debug(
+        "User %s has followed %s and unfollowed %s users in a batch",
+        current_user,
+        len(followed),
+        len(unfollowed),
+    )
+
+    return {"result": "true", "results": results}
+
+
+@app.get("/api/tweets", response_model=TweetAnswer)
+async def get_tweets(
+        cursor: Union[str, None] = Query(default=None, title="Cursor of the next page"),
+        limit: int = Query(default=50, ge=1, le=200, title="Page size"),
+        preview: Union[int, None] = Query(
+            default=None, ge=0, le=100, title="Number of likers to include"
+        ),
+        if_none_match: Annotated[Union[str, None], Header()] = None,
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
+):
+    logger.debug("Get tweet for user %s", current_user)
+    if cursor is not None:
+        try:
+            cursor = decode_cursor(cursor)
+        except CursorError:
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST, detail="Invalid cursor."
+            )
+    with_likes = preview is None
+    if TIMELINE_FANOUT:
+        versions = await get_timeline_versions(
+            session, current_user.id, limit + 1, cursor
+        )
+    else:
+        versions = await TweetService.get_feed_versions(
+            session, current_user.id, limit + 1, cursor
+        )
+    # the page is fully determined by its tweets and their likes, so a poll
+    # that finds neither changed is answered before any tweet is loaded
+    etag = make_etag(orjson.dumps([versions, limit, preview]))
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+    tweets_list = await TweetService.get_tweets_by_ids(
+        session, [id for id, _ in versions], with_likes
+    )
+    next_cursor = None
+    if len(tweets_list) > limit:
+        tweets_list = tweets_list[:limit]
+        next_cursor = encode_cursor(tweets_list[-1].created_at, tweets_list[-1].id)
+
+    if with_likes:
+        likers = {
+            tweet.id: [like.user_id for like in tweet.likes] for tweet in tweets_list
+        }
+    else:
+        likers = await LikesService.get_likers_preview(
+            session, [tweet.id for tweet in tweets_list], preview
         )
-    result = {"result": "true", "tweets": tweets}
-    return result
 
+    users_ids = set()
+    for tweet in tweets_list:
+        users_ids.add(tweet.author)
+        users_ids.update(likers[tweet.id])
+    users = await UserService.get_users_short(session, list(users_ids)) if users_ids else {}
 
-@app.get(
-    "/api/users/me", dependencies=[Depends(token_required)], response_model=UserAnswer
-)
-async def personal_page(current_user: Users = Depends(token_required)) -> Users:
-    await logger.debug(f"User {current_user} visit personal page")
-    followers_list = await FollowersService.get_followers_lst(current_user.id)
-    followers_list = [follower.to_json() for follower in followers_list]
+    tweets = [tweet_payload(tweet, users, likers[tweet.id]) for tweet in tweets_list]
+    return ORJSONResponse(feed_payload(tweets, next_cursor), headers=etag_headers(etag))
 
-    following_list = await FollowersService.get_following_lst(current_user.id)
-    following_list = [follow.to_json() for follow in following_list]
 
-    current_user = current_user.to_json()
-    current_user["followers"] = followers_list
-    current_user["following"] = following_list
-    result = {"result": "true", "user": current_user}
-    return result
+@app.get("/api/tweets/stream", response_class=EventStreamResponse)
+async def tweets_stream(
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
+):
+    logger.debug("User %s has subscribed to the tweet stream", current_user)
+    following = await FollowersService.get_following_ids(session, current_user.id)
+    # the stream outlives the request and must not hold a pooled connection
+    await session.close()
+    return EventStreamResponse(current_user.id, following)
 
 
-@app.get(
-    "/api/users/{id}", dependencies=[Depends(token_required)], response_model=UserAnswer
-)
-async def user_page(id: int = Path(title="Id of the user"), current_user: Users = Depends(token_required)) -> Users:
-    await logger.debug(f"User {current_user} visit personal page of user id =  {id}")
-    followers_list = await FollowersService.get_followers_lst(id)
-    followers_list = [follower.to_json() for follower in followers_list]
+async def get_user_page(
+        session: AsyncSession,
+        user_id: int,
+        preview: int,
+        if_none_match: Union[str, None],
+):
+    page = profile_cache.get(user_id, preview)
+    if page is None:
+        user = await UserService.get_profile(session, user_id)
+        if user is None:
+            logger.warning("Wrong request to database for user id = %s", user_id)
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST, detail="No such user in database."
+            )
+        followers = await FollowersService.get_followers_page(
+            session, user_id, preview
+        )
+        following = await FollowersService.get_following_page(
+            session, user_id, preview
+        )
+        page = profile_cache.render(
+            user_id, preview, user_page_payload(user, followers, following)
+        )
+    if etag_matches(if_none_match, page.etag):
+        return not_modified(page.etag)
+    return json_response(page.body, page.etag)
+
+
+@app.get("/api/users/me", response_model=UserAnswer)
+async def personal_page(
+        preview: int = Query(
+            default=PROFILE_LIST_LIMIT,
+            ge=0,
+            le=PROFILE_LIST_LIMIT,
+            title="Number of followers to include",
+        ),
+        if_none_match: Annotated[Union[str, None], Header()] = None,
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
+) -> Users:
+    logger.debug("User %s visit personal page", current_user)
+    return await get_user_page(session, current_user.id, preview, if_none_match)
+
+
+@app.get("/api/users/{id}", response_model=UserAnswer)
+async def user_page(
+        id: int = Path(title="Id of the user"),
+        preview: int = Query(
+            default=PROFILE_LIST_LIMIT,
+            ge=0,
+            le=PROFILE_LIST_LIMIT,
+            title="Number of followers to include",
+        ),
+        if_none_match: Annotated[Union[str, None], Header()] = None,
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
+) -> Users:
+    logger.debug("User %s visit personal page of user id =  %s", current_user, id)
+    return await get_user_page(session, id, preview, if_none_match)
+
+
+async def get_users_list(get_page, session: AsyncSession, user_id: int, cursor, limit):
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_id_cursor(cursor)
+        except CursorError:
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST, detail="Invalid cursor."
+            )
+    users = await get_page(session, user_id, limit + 1, after)
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_id_cursor(users[-1]["id"])
+    return {"result": "true", "users": users, "next_cursor": next_cursor}
+
+
+@app.get("/api/users/{id}/followers", response_model=UserListAnswer)
+async def user_followers(
+        id: int = Path(title="Id of the user"),
+        cursor: Union[str, None] = Query(default=None, title="Cursor of the next page"),
+        limit: int = Query(default=50, ge=1, le=200, title="Page size"),
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
+):
+    logger.debug("User %s visit followers of user id = %s", current_user, id)
+    return await get_users_list(
+        FollowersService.get_followers_page, session, id, cursor, limit
+    )
+
+
+@app.get("/api/users/{id}/following", response_model=UserListAnswer)
+async def user_following(
+        id: int = Path(title="Id of the user"),
+        cursor: Union[str, None] = Query(default=None, title="Cursor of the next page"),
+        limit: int = Query(default=50, ge=1, le=200, title="Page size"),
+        current_user: Principal = Depends(token_required),
+        session: AsyncSession = Depends(get_session),
+):
+    logger.debug("User %s visit following of user id = %s", current_user, id)
+    return await get_users_list(
+        FollowersService.get_following_page, session, id, cursor, limit
+    )
 
-    following_list = await FollowersService.get_following_lst(id)
-    following_list = [follow.to_json() for follow in following_list]
 
-    user = await UserService.get_user_by_id(id)
-    user = user.to_json()
-    user["followers"] = followers_list
-    user["following"] = following_list
-    result = {"result": "true", "user": user}
-    return result
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics_page():
+    series = await asyncio.to_thread(metrics.gather)
+    return PlainTextResponse(render(series), media_type="text/plain; version=0.0.4")
 
 
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
-    logger.error(f'status_code: {exc.status_code}, error: {exc.detail}')
+    logger.error("status_code: %s, error: %s", exc.status_code, exc.detail)
     return JSONResponse(status_code=exc.status_code, content={"error": exc.detail})
@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Set
+from uuid import uuid4
+
+from aiofiles import open as aio_open
+from dotenv import load_dotenv
+from fastapi import UploadFile
+from PIL import Image
+from sqlalchemy.ext.asyncio import AsyncSession
+
+load_dotenv()
+
+from src.cache import TTLCache
+from src.db_services import MediaService
+from src.imaging import FORMATS, VARIANTS, render_variants, variant_filename
+from src.models import Media, MediaBlobs
+
+MEDIA_ROOT = Path(os.getenv("MEDIA_ROOT", "storage"))
+MEDIA_MAX_SIZE = int(os.getenv("MEDIA_MAX_SIZE", 10 * 1024 * 1024))
+MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", 1024 * 1024))
+MEDIA_SWEEP_INTERVAL = float(os.getenv("MEDIA_SWEEP_INTERVAL", 300))
+MEDIA_SWEEP_GRACE = float(os.getenv("MEDIA_SWEEP_GRACE", 600))
+MEDIA_SWEEP_BATCH = int(os.getenv("MEDIA_SWEEP_BATCH", 500))
+MEDIA_VARIANT_WORKERS = int(os.getenv("MEDIA_VARIANT_WORKERS", 2))
+MEDIA_VARIANT_QUEUE = int(os.getenv("MEDIA_VARIANT_QUEUE", 64))
+MEDIA_VARIANT_FAILURES = int(os.getenv("MEDIA_VARIANT_FAILURES", 10000))
+MEDIA_VARIANT_FAILURE_TTL = float(os.getenv("MEDIA_VARIANT_FAILURE_TTL", 3600))
+
+EXTENSION_RE = re.compile(r"^\.[A-Za-z0-9]{1,10}$")
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class StagedUpload(NamedTuple):
+    path: Path
+    sha256: str
+    size: int
+
+
+def exceeds_max_size(size: int) -> bool:
+    return size > MEDIA_MAX_SIZE
+
+
+def safe_extension(filename: str) -> str:
+    extension = Path(filename).suffix.lower()
+    return extension if EXTENSION_RE.match(extension) else ""
+
+
+def blob_path(name: str) -> Path:
+    return MEDIA_ROOT / MediaBlobs.relpath(name)
+
+
+def legacy_media_path(media_id: int, extension: Optional[str]) -> Path:
+    # media uploaded before blobs were introduced, see Media.to_json
+    return MEDIA_ROOT / f"{media_id}{extension or '.jpg'}"
+
+
+def blob_extension(name: str) -> str:
+    return Path(name).suffix
+
+
+def variants_dir(name: str) -> Path:
+    return MEDIA_ROOT / MediaBlobs.variants_relpath(name)
+
+
+def variant_urls(media: Media) -> Dict[str, str]:
+    if not media.blob or blob_extension(media.blob) not in FORMATS:
+        return {}
+    extension = blob_extension(media.blob)
+    prefix = f"/storage/{MediaBlobs.variants_relpath(media.blob)}"
+    return {
+        variant: f"{prefix}/{variant_filename(variant, extension)}"
+        for variant in VARIANTS
+    }
+
+
+async def stage_upload(file: UploadFile) -> StagedUpload:
+    """Stream the upload into a temporary file inside MEDIA_ROOT.
+
+    Only one chunk is held in memory at a time, the content hash is computed
+    on the way, and the upload is rejected as soon as it grows past
+    MEDIA_MAX_SIZE.
+    """
+    MEDIA_ROOT.mkdir(parents=True, exist_ok=True)
+    tmp_path = MEDIA_ROOT / f".{uuid4().hex}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aio_open(tmp_path, "wb") as f:
+            while chunk := await file.read(MEDIA_CHUNK_SIZE):
+                size += len(chunk)
+                if exceeds_max_size(size):
+                    raise MediaTooLarge(f"Upload is larger than {MEDIA_MAX_SIZE} bytes")
+                digest.update(chunk)
+                await f.write(chunk)
+            await f.flush()
+            await asyncio.to_thread(os.fsync, f.fileno())
+    except BaseException:
+        discard_upload(tmp_path)
+        raise
+    return StagedUpload(tmp_path, digest.hexdigest(), size)
+
+
+def publish_upload(tmp_path: Path, destination: Path) -> None:
+    # identical content always lands on the same path, so replacing an
+    # existing blob is harmless
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, destination)
+
+
+def discard_upload(*paths: Path) -> None:
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+async def sweep_blobs(session: AsyncSession) -> int:
+    """Remove blobs nothing has referenced for at least MEDIA_SWEEP_GRACE.
+
+    The grace period covers uploads that are still between taking their
+    reference and publishing the file.
+    """
+    released_before = datetime.utcnow() - timedelta(seconds=MEDIA_SWEEP_GRACE)
+    names = await MediaService.get_released_blobs(
+        session, released_before, MEDIA_SWEEP_BATCH
+    )
+    removed = 0
+    for name in names:
+        if await MediaService.delete_released_blob(session, name):
+            # the deleted row stays locked until the commit, so an upload of
+            # the same content waits and publishes its file after the unlink
+            discard_upload(blob_path(name))
+            await session.commit()
+            removed += 1
+    await session.commit()
+    return removed
+
+
+_variant_pool: Optional[ProcessPoolExecutor] = None
+_variant_jobs: Dict[str, asyncio.Future] = {}
+_variant_tasks: Set[asyncio.Task] = set()
+# blobs are named by their content, so one that failed to render fails again
+_variant_failures = TTLCache(MEDIA_VARIANT_FAILURES, MEDIA_VARIANT_FAILURE_TTL)
+
+
+def get_variant_pool() -> ProcessPoolExecutor:
+    global _variant_pool
+    if _variant_pool is None:
+        # a fresh interpreter rather than a fork of the running event loop
+        _variant_pool = ProcessPoolExecutor(
+            max_workers=MEDIA_VARIANT_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _variant_pool
+
+
+def shutdown_variant_pool() -> None:
+    global _variant_pool
+    if _variant_pool is not None:
+        _variant_pool.shutdown(wait=False, cancel_futures=True)
+        _variant_pool = None
+
+
+def has_variants(name: str) -> bool:
+    extension = blob_extension(name)
+    return all(
+        (variants_dir(name) / variant_filename(variant, extension)).exists()
+        for variant in VARIANTS
+    )
+
+
+async def ensure_variants(name: str) -> bool:
+    """Render the variants of a blob unless they already exist.
+
+    Concurrent callers for the same blob share one job. Returns False when
+    the blob is not an image the variants can be rendered from, which is
+    remembered for MEDIA_VARIANT_FAILURE_TTL and not retried. Other errors,
+    e.g. of the process pool, are raised and the next call tries again.
+    """
+    extension = blob_extension(name)
+    if extension not in FORMATS or not blob_path(name).exists():
+        return False
+    if _variant_failures.get(name) is not None:
+        return False
+    job = _variant_jobs.get(name)
+    if job is None:
+        if has_variants(name):
+            return True
+        job = asyncio.get_running_loop().run_in_executor(
+            get_variant_pool(),
+            render_variants,
+            str(blob_path(name)),
+            str(variants_dir(name)),
+            extension,
+        )
+        _variant_jobs[name] = job
+        job.add_done_callback(lambda _: _variant_jobs.pop(name, None))
+    try:
+        await job
+    except Exception as exc:
+        if isinstance(exc, BrokenProcessPool):
+            # a crashed worker breaks the whole pool, the next job gets a new one
+            shutdown_variant_pool()
+        if not is_bad_image(exc):
+            raise
+        _variant_failures.set(name, True)
+        return False
+    return True
+
+
+def is_bad_image(exc: Exception) -> bool:
+    # Pillow reports undecodable and truncated images as OSErrors without an
+    # errno; the ones with an errno, like a full disk, are not the image's
+    return isinstance(exc, Image.DecompressionBombError) or (
+        isinstance(exc, OSError) and exc.errno is None
+    )
+
+
+def schedule_variants(name: str) -> Optional[asyncio.Task]:
+    # past the queue limit variants are left to be rendered on first request
+    if len(_variant_jobs) >= MEDIA_VARIANT_QUEUE:
+        return None
+    task = asyncio.create_task(ensure_variants(name))
+    _variant_tasks.add(task)
+    task.add_done_callback(_variant_tasks.discard)
+    return task
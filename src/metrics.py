@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# family name -> (type, help)
+METRIC_FAMILIES = {
+    "http_requests_total": ("counter", "HTTP requests by route template and status."),
+    "http_request_duration_seconds": (
+        "histogram",
+        "HTTP request latency by route template.",
+    ),
+    "db_pool_checked_out": ("gauge", "Database connections currently checked out."),
+    "db_pool_overflow": ("gauge", "Database connections open beyond pool_size."),
+    "auth_cache_hits_total": ("counter", "API-key lookups answered from the cache."),
+    "auth_cache_misses_total": (
+        "counter",
+        "API-key lookups that went to the database.",
+    ),
+    "auth_cache_size": ("gauge", "Principals currently held in the auth cache."),
+    "stream_connections": ("gauge", "Open tweet stream connections."),
+    "stream_events_total": ("counter", "Events published to tweet streams."),
+    "stream_slow_disconnects_total": (
+        "counter",
+        "Tweet streams closed because the client fell behind.",
+    ),
+    "profile_cache_hits_total": ("counter", "Profile pages served from the cache."),
+    "profile_cache_misses_total": (
+        "counter",
+        "Profile pages rendered from the database.",
+    ),
+    "profile_cache_size": ("gauge", "Users whose profile pages are cached."),
+    "profile_cache_invalidations_total": (
+        "counter",
+        "Users whose cached profile pages were dropped.",
+    ),
+    "profile_cache_invalidation_seconds_total": (
+        "counter",
+        "Time spent dropping cached profile pages.",
+    ),
+    "media_upload_bytes_total": ("counter", "Bytes of media accepted by uploads."),
+    "log_dropped_total": ("counter", "Log messages dropped on a full queue or a failed write."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+Series = Dict[Tuple[str, Labels], float]
+
+
+class Metrics:
+    """Metrics of one worker process.
+
+    Recording is plain dict arithmetic on the event loop thread, with no
+    locks; everything is flattened into Prometheus series only at scrape
+    time. With METRICS_DIR set, each worker also dumps its series there and
+    a scrape on any worker sums the series of all of them.
+    """
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._requests: Dict[Tuple[str, str, int], int] = {}
+        # (method, route) -> per bucket counts, then +Inf count and the sum
+        self._latency: Dict[Tuple[str, str], List[float]] = {}
+        self._counters: Dict[str, float] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Labels, float]]]] = []
+
+    def observe_request(
+        self, method: str, route: str, status: int, seconds: float
+    ) -> None:
+        key = (method, route, status)
+        self._requests[key] = self._requests.get(key, 0) + 1
+        latency = self._latency.get((method, route))
+        if latency is None:
+            latency = self._latency[(method, route)] = [0] * (len(self.buckets) + 2)
+        latency[bisect_left(self.buckets, seconds)] += 1
+        latency[-1] += seconds
+
+    def inc(self, name: str, value: float = 1) -> None:
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def register_collector(
+        self, collector: Callable[[], Iterable[Tuple[str, Labels, float]]]
+    ) -> None:
+        self._collectors.append(collector)
+
+    def collect(self) -> Series:
+        series: Series = {}
+        for (method, route, status), count in self._requests.items():
+            labels = (("method", method), ("route", route), ("status", str(status)))
+            series[("http_requests_total", labels)] = count
+        for (method, route), latency in self._latency.items():
+            labels = (("method", method), ("route", route))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), latency[:-1]):
+                cumulative += count
+                series[
+                    (
+                        "http_request_duration_seconds_bucket",
+                        labels + (("le", str(bound)),),
+                    )
+                ] = cumulative
+            series[("http_request_duration_seconds_sum", labels)] = latency[-1]
+            series[("http_request_duration_seconds_count", labels)] = cumulative
+        for name, value in self._counters.items():
+            series[(name, ())] = value
+        for collector in self._collectors:
+            for name, labels, value in collector():
+                series[(name, labels)] = value
+        return series
+
+    def snapshot_path(self, pid: Optional[int] = None) -> str:
+        return os.path.join(METRICS_DIR, f"metrics-{pid or os.getpid()}.json")
+
+    def flush(self) -> None:
+        if not METRICS_DIR:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = self.snapshot_path()
+        data = [
+            [name, list(labels), value]
+            for (name, labels), value in self.collect().items()
+        ]
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+
+    def remove_snapshot(self) -> None:
+        if METRICS_DIR:
+            try:
+                os.remove(self.snapshot_path())
+            except FileNotFoundError:
+                pass
+
+    def gather(self) -> Series:
+        series = self.collect()
+        if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+            return series
+        own = os.path.basename(self.snapshot_path())
+        stale_before = time.time() - 5 * METRICS_FLUSH_INTERVAL
+        for entry in os.scandir(METRICS_DIR):
+            if (
+                entry.name == own
+                or not entry.name.endswith(".json")
+                or entry.stat().st_mtime < stale_before
+            ):
+                continue
+            try:
+                with open(entry.path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in data:
+                key = (name, tuple(tuple(label) for label in labels))
+                series[key] = series.get(key, 0) + value
+        return series
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _family(name: str) -> str:
+    for suffix in ("_bucket", "_sum", "_count"):
+        family = name[: -len(suffix)]
+        if (
+            name.endswith(suffix)
+            and METRIC_FAMILIES.get(family, ("",))[0] == "histogram"
+        ):
+            return family
+    return name
+
+
+def render(series: Series) -> str:
+    families: Dict[str, List[str]] = {}
+    for (name, labels), value in series.items():
+        label_text = ",".join(f'{key}="{_escape(label)}"' for key, label in labels)
+        line = f"{name}{{{label_text}}} {value}" if labels else f"{name} {value}"
+        families.setdefault(_family(name), []).append(line)
+    lines = []
+    for family, family_lines in families.items():
+        kind, help_text = METRIC_FAMILIES.get(family, ("untyped", ""))
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        lines.extend(family_lines)
+    return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
@@ -1,9 +1,19 @@
 from __future__ import annotations
 from typing import List
+from datetime import datetime
 import os
 from dotenv import load_dotenv
 from sqlalchemy.orm import relationship, Mapped
-from sqlalchemy import Column, Integer, String, ForeignKey, PrimaryKeyConstraint
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    DateTime,
+    ForeignKey,
+    PrimaryKeyConstraint,
+    Index,
+    func,
+)
 from sqlalchemy.ext.associationproxy import association_proxy, AssociationProxy
 
 load_dotenv()
@@ -33,7 +43,10 @@ class Followers(Base):
         foreign_keys=[user_id],
     )  # подписки
 
-    __table_args__ = (PrimaryKeyConstraint("follower_id", "user_id"),)
+    __table_args__ = (
+        PrimaryKeyConstraint("follower_id", "user_id"),
+        Index("ix_followers_user_id_follower_id", "user_id", "follower_id"),
+    )
 
 
 class Users(Base):
@@ -41,7 +54,9 @@ class Users(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(50), nullable=False)
-    api_key = Column(String(50), nullable=False)
+    api_key = Column(String(50), nullable=False, unique=True, index=True)
+    follower_count = Column(Integer, nullable=False, default=0, server_default="0")
+    following_count = Column(Integer, nullable=False, default=0, server_default="0")
     followers_associations: Mapped[List[Followers]] = relationship(
         "Followers",
         back_populates="followers",
@@ -80,27 +95,70 @@ class Tweets(Base):
     attachments = relationship("Media", backref="tweet", lazy="joined", cascade="all")
     author = Column(Integer, ForeignKey("users.id"), nullable=False)
     likes = relationship("Likes", backref="tweet", lazy="joined", cascade="all")
+    like_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # bumped by every like and unlike, so the feed ETag also changes when one
+    # like replaces another and like_count stays the same
+    likes_version = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(
+        DateTime, nullable=False, default=datetime.utcnow, server_default=func.now()
+    )
+    # set when the author deletes the tweet, the row itself is purged later
+    deleted_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_tweets_author_created_at_id", "author", "created_at", "id"),
+        Index("ix_tweets_deleted_at", "deleted_at"),
+    )
 
     def to_json(self):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
 
+class MediaBlobs(Base):
+    __tablename__ = "media_blobs"
+
+    # sha256 hex digest of the content followed by the file extension
+    name = Column(String(80), primary_key=True)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(
+        DateTime, nullable=False, default=datetime.utcnow, server_default=func.now()
+    )
+
+    # the sweeper looks for released blobs
+    __table_args__ = (
+        Index("ix_media_blobs_ref_count_updated_at", "ref_count", "updated_at"),
+    )
+
+    @staticmethod
+    def relpath(name: str) -> str:
+        return f"blobs/{name[:2]}/{name[2:4]}/{name}"
+
+    @staticmethod
+    def variants_relpath(name: str) -> str:
+        return f"variants/{name[:2]}/{name[2:4]}/{name}"
+
+
 class Media(Base):
     __tablename__ = "media"
 
     id = Column(Integer, primary_key=True)
     extension = Column(String, nullable=True)
     tweet_id = Column(Integer, ForeignKey("tweets.id"), nullable=True)
+    blob = Column(String(80), ForeignKey("media_blobs.name"), nullable=True)
+
+    __table_args__ = (Index("ix_media_tweet_id", "tweet_id"),)
 
     def to_json(self) -> dict:
-        if self.extension:
-            file_ext = self.extension
+        if self.blob:
+            url = f"/storage/{MediaBlobs.relpath(self.blob)}"
         else:
-            file_ext = ".jpg"
+            file_ext = self.extension or ".jpg"
+            url = f"/storage/{self.id}{file_ext}"
         return {
             "image_id": self.id,
             "tweet_id": self.tweet_id,
-            "url": f"/storage/{self.id}{file_ext}",
+            "url": url,
         }
 
 
@@ -0,0 +1,37 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from datetime import datetime
+from typing import Tuple
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    raw = f"{created_at.isoformat()}|{id}".encode()
+    return urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        created_at, id = datetime.fromisoformat(created_at), int(id)
+    except (DecodeError, UnicodeDecodeError, ValueError) as exc:
+        raise CursorError(f"Invalid cursor {cursor!r}") from exc
+    # created_at is stored naive, and comparing it with an aware value fails
+    # in the database driver
+    if created_at.tzinfo is not None:
+        raise CursorError(f"Invalid cursor {cursor!r}")
+    return created_at, id
+
+
+def encode_id_cursor(id: int) -> str:
+    return urlsafe_b64encode(str(id).encode()).decode()
+
+
+def decode_id_cursor(cursor: str) -> int:
+    try:
+        return int(urlsafe_b64decode(cursor.encode()).decode())
+    except (DecodeError, UnicodeDecodeError, ValueError) as exc:
+        raise CursorError(f"Invalid cursor {cursor!r}") from exc
@@ -0,0 +1,109 @@
+import os
+import time
+from typing import Callable, Dict, Iterable, NamedTuple, Optional
+
+import orjson
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+load_dotenv()
+
+from src.cache import TTLCache
+from src.etags import make_etag
+from src.models import Users
+from src.replicas import READ_YOUR_WRITES_WINDOW, replicas
+
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", 10000))
+# follows are invalidated as they happen, the TTL only bounds how long a
+# renamed follower or another worker's follow can stay unnoticed
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", 60))
+# preview may be anything from 0 to 100; only these sizes are cached, so one
+# user holds a few rendered pages at most and other sizes are rendered anew
+PROFILE_CACHE_PREVIEWS = frozenset(
+    int(size) for size in os.getenv("PROFILE_CACHE_PREVIEWS", "0,10,100").split(",")
+)
+
+
+class CachedPage(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class ProfileCache:
+    """Rendered profile pages of recently viewed users, keyed by user id.
+
+    One entry holds the pages of a user for each of the ``previews`` sizes,
+    so a follow drops all of them with a single lookup. For ``hold``
+    seconds after that a page is not cached again: it might have been read
+    from a replica that has not seen the follow yet.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        hold: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+        previews: Iterable[int] = PROFILE_CACHE_PREVIEWS,
+    ):
+        self.previews = frozenset(previews)
+        self.pages = TTLCache(maxsize, ttl, clock)
+        self.held = TTLCache(maxsize, hold, clock) if hold > 0 else None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.invalidation_seconds = 0.0
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def get(self, user_id: int, preview: int) -> Optional[CachedPage]:
+        if preview not in self.previews:
+            return None
+        pages: Optional[Dict[int, CachedPage]] = self.pages.get(user_id)
+        page = pages.get(preview) if pages is not None else None
+        if page is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return page
+
+    def render(self, user_id: int, preview: int, payload: dict) -> CachedPage:
+        body = orjson.dumps(payload)
+        page = CachedPage(body, make_etag(body))
+        if preview not in self.previews or (
+            self.held is not None and self.held.get(user_id) is not None
+        ):
+            return page
+        pages = self.pages.get(user_id)
+        if pages is None:
+            self.pages.set(user_id, {preview: page})
+        else:
+            pages[preview] = page
+        return page
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        started = time.perf_counter()
+        for user_id in user_ids:
+            self.pages.invalidate(user_id)
+            if self.held is not None:
+                self.held.set(user_id, True)
+            self.invalidations += 1
+        self.invalidation_seconds += time.perf_counter() - started
+
+
+profile_cache = ProfileCache(
+    PROFILE_CACHE_SIZE,
+    PROFILE_CACHE_TTL,
+    hold=READ_YOUR_WRITES_WINDOW if replicas else 0.0,
+)
+
+
+def invalidate_profiles(*user_ids: int) -> None:
+    profile_cache.invalidate(user_ids)
+
+
+@event.listens_for(Users, "after_update")
+@event.listens_for(Users, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    invalidate_profiles(target.id)
@@ -0,0 +1,78 @@
+import functools
+import itertools
+import os
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from src.cache import TTLCache
+from src.database import RoutingSession, replica_engines
+from src.request_stats import current_request
+
+load_dotenv()
+
+# replicas lag behind the primary, so for this many seconds after a user's
+# own write their reads stay on the primary and they see what they just did
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", 5))
+READ_YOUR_WRITES_SIZE = int(os.getenv("READ_YOUR_WRITES_SIZE", 100000))
+
+replicas: List[AsyncEngine] = replica_engines
+recent_writers = TTLCache(maxsize=READ_YOUR_WRITES_SIZE, ttl=READ_YOUR_WRITES_WINDOW)
+_next_replica = itertools.count()
+
+
+def choose_replica(session: AsyncSession) -> Optional[AsyncEngine]:
+    """Return the replica the session may read from, None for the primary."""
+    if not replicas or session.info.get("wrote"):
+        return None
+    stats = current_request()
+    if stats is not None and stats.user_id is not None:
+        if recent_writers.get(stats.user_id) is not None:
+            return None
+    return replicas[next(_next_replica) % len(replicas)]
+
+
+@asynccontextmanager
+async def use_replica(session: AsyncSession):
+    if session.info.get("replica") is not None:
+        yield
+        return
+    session.info["replica"] = choose_replica(session)
+    try:
+        yield
+    finally:
+        session.info.pop("replica", None)
+
+
+def replica_read(method):
+    """Run a read-only service method against a replica when one may be used."""
+
+    @functools.wraps(method)
+    async def wrapper(cls, session: AsyncSession, *args, **kwargs):
+        async with use_replica(session):
+            return await method(cls, session, *args, **kwargs)
+
+    return wrapper
+
+
+def _record_write(session) -> None:
+    # the rest of the session's transaction and the user's next requests
+    # must not read from a replica that has not caught up yet
+    session.info["wrote"] = True
+    stats = current_request()
+    if stats is not None and stats.user_id is not None:
+        recent_writers.set(stats.user_id, True)
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _on_execute(orm_execute_state):
+    if not orm_execute_state.is_select:
+        _record_write(orm_execute_state.session)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _on_flush(session, flush_context):
+    _record_write(session)
@@ -0,0 +1,62 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+from src.database import engine, replica_engines
+
+
+class RequestStats:
+    __slots__ = ("started", "query_count", "db_time", "user_id")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.db_time = 0.0
+        self.user_id: Optional[int] = None
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def start_request() -> RequestStats:
+    # the object is shared, not copied, with the tasks the request spawns,
+    # so counters updated deeper in the request are visible to the middleware
+    stats = RequestStats()
+    _request_stats.set(stats)
+    return stats
+
+
+def current_request() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def set_request_user(user_id: int) -> None:
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.user_id = user_id
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    stats = _request_stats.get()
+    if stats is None or context is None:
+        return
+    stats.query_count += 1
+    stats.db_time += time.perf_counter() - context._query_started
+
+
+for _engine in [engine, *replica_engines]:
+    event.listen(_engine.sync_engine, "before_cursor_execute", _start_query_timer)
+    event.listen(_engine.sync_engine, "after_cursor_execute", _stop_query_timer)
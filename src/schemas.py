@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Union
+from typing import Literal, Union
 
 
 class TweetBase(BaseModel):
@@ -35,8 +35,10 @@ class PostAnswer(Answer):
 class TweetInlist(TweetBase):
     id: int
     attachments: list[str] = []
+    attachment_variants: list[dict[str, str]] = []
     author: User
     likes: list[Like] = []
+    like_count: int = 0
 
     class Config:
         orm_mode = True
@@ -44,16 +46,60 @@ class TweetInlist(TweetBase):
 
 class TweetAnswer(Answer):
     tweets: list[TweetInlist]
+    next_cursor: Union[str, None] = None
 
 
 class UserPage(User):
     followers: list[User]
     following: list[User]
+    follower_count: int = 0
+    following_count: int = 0
 
 
 class UserAnswer(Answer):
     user: UserPage
 
 
+class UserListAnswer(Answer):
+    users: list[User]
+    next_cursor: Union[str, None] = None
+
+
 class MediaAnswer(Answer):
     media_id: int
+
+
+class LikeOperation(BaseModel):
+    tweet_id: int
+    action: Literal["like", "unlike"] = "like"
+
+
+class FollowOperation(BaseModel):
+    user_id: int
+    action: Literal["follow", "unfollow"] = "follow"
+
+
+class LikesBatch(BaseModel):
+    operations: list[LikeOperation]
+
+
+class FollowsBatch(BaseModel):
+    operations: list[FollowOperation]
+
+
+class LikeResult(LikeOperation):
+    result: bool
+    error: Union[str, None] = None
+
+
+class FollowResult(FollowOperation):
+    result: bool
+    error: Union[str, None] = None
+
+
+class LikesBatchAnswer(Answer):
+    results: list[LikeResult]
+
+
+class FollowsBatchAnswer(Answer):
+    results: list[FollowResult]
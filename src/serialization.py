@@ -0,0 +1,56 @@
+"""Response payloads built directly in the shape of their response_model.
+
+For a returned dict FastAPI validates it against ``response_model``, dumps
+the validated model back to Python and encodes that with the json module.
+The feed and profile handlers build their payloads from database rows whose
+types already match the models, so they return ``ORJSONResponse`` and skip
+all three steps. Validation used to put the keys in model field order, so
+the payloads here have to list them in that order themselves; the tests
+compare both paths byte for byte.
+"""
+
+from typing import Dict, List, Optional
+
+from src.media_storage import variant_urls
+from src.models import Tweets
+
+
+def tweet_payload(tweet: Tweets, users: Dict[int, dict], likers: List[int]) -> dict:
+    # TweetInlist
+    return {
+        "content": tweet.content,
+        "id": tweet.id,
+        "attachments": [
+            attachment.to_json()["url"] for attachment in tweet.attachments
+        ],
+        "attachment_variants": [
+            variant_urls(attachment) for attachment in tweet.attachments
+        ],
+        "author": users[tweet.author],
+        "likes": [
+            {"user_id": user_id, "name": users[user_id]["name"]} for user_id in likers
+        ],
+        "like_count": tweet.like_count,
+    }
+
+
+def feed_payload(tweets: List[dict], next_cursor: Optional[str]) -> dict:
+    # TweetAnswer
+    return {"result": True, "tweets": tweets, "next_cursor": next_cursor}
+
+
+def user_page_payload(
+    profile: dict, followers: List[dict], following: List[dict]
+) -> dict:
+    # UserAnswer
+    return {
+        "result": True,
+        "user": {
+            "id": profile["id"],
+            "name": profile["name"],
+            "followers": followers,
+            "following": following,
+            "follower_count": profile["follower_count"],
+            "following_count": profile["following_count"],
+        },
+    }
@@ -0,0 +1,131 @@
+"""Production entry point: migrate the database once, then start the workers.
+
+    python -m src.serve              # migrate, then serve WEB_CONCURRENCY workers
+    python -m src.serve migrate      # only migrate, e.g. as a separate deploy job
+    python -m src.serve --no-migrate # only serve, after such a job
+
+Workers never touch the schema (DB_CREATE_ALL is turned off for them) and
+each one logs to its own app.<pid>.log / access.<pid>.log, so starting many
+of them at once races neither on DDL nor on the log files.
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+import uvicorn
+from alembic import command
+from alembic.config import Config
+from dotenv import load_dotenv
+from sqlalchemy import inspect
+
+load_dotenv()
+
+from src.database import DATABASE_URL, engine
+from src.models import Base
+from src.timeline import TIMELINE_FANOUT
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+SERVE_HOST = os.getenv("SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.getenv("SERVE_PORT", 8000))
+SERVE_BACKLOG = int(os.getenv("SERVE_BACKLOG", 2048))
+SERVE_KEEPALIVE = int(os.getenv("SERVE_KEEPALIVE", 5))
+# open event streams are dropped after this long on shutdown
+SERVE_GRACEFUL_TIMEOUT = int(os.getenv("SERVE_GRACEFUL_TIMEOUT", 10))
+SERVE_MIGRATE = os.getenv("SERVE_MIGRATE", "true").lower() == "true"
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+
+
+def alembic_config() -> Config:
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option("script_location", str(ALEMBIC_INI.parent / "alembic"))
+    # ConfigParser treats % as interpolation, and escaped passwords contain it
+    config.set_main_option("sqlalchemy.url", DATABASE_URL.replace("%", "%%"))
+    return config
+
+
+# the schema create_all built before the app was migrated with Alembic
+UNVERSIONED_REVISION = "5e3cebe3306e"
+
+
+async def _prepare_schema() -> Optional[str]:
+    """Revision to stamp the database with before upgrading, if any.
+
+    An empty database gets the current models directly. A database that has
+    tables but no alembic_version was built by create_all at startup, before
+    the later revisions existed.
+    """
+    async with engine.begin() as conn:
+        tables = await conn.run_sync(
+            lambda sync_conn: inspect(sync_conn).get_table_names()
+        )
+        if not tables:
+            await conn.run_sync(Base.metadata.create_all)
+    await engine.dispose()
+    if not tables:
+        return "head"
+    if "alembic_version" not in tables:
+        return UNVERSIONED_REVISION
+    return None
+
+
+def migrate() -> None:
+    """Bring the database to the latest revision.
+
+    The revisions start from the schema create_all used to build, so an
+    empty database is stamped as up to date instead of replaying them, and
+    one create_all built before Alembic is stamped with that first schema.
+    """
+    config = alembic_config()
+    revision = asyncio.run(_prepare_schema())
+    if revision is not None:
+        command.stamp(config, revision)
+    command.upgrade(config, "head")
+
+
+def serve(workers: int) -> None:
+    if workers > 1 and TIMELINE_FANOUT:
+        # a tweet written through one worker would never reach the timelines
+        # the other workers keep in memory
+        raise SystemExit("TIMELINE_FANOUT keeps timelines per process, use one worker")
+    # the workers are spawned with a copy of this environment
+    os.environ["DB_CREATE_ALL"] = "false"
+    os.environ["LOG_PER_PROCESS"] = "true"
+    if workers > 1 and not os.getenv("METRICS_DIR"):
+        os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix="metrics-")
+    uvicorn.run(
+        "src.main:app",
+        host=SERVE_HOST,
+        port=SERVE_PORT,
+        workers=workers,
+        backlog=SERVE_BACKLOG,
+        timeout_keep_alive=SERVE_KEEPALIVE,
+        timeout_graceful_shutdown=SERVE_GRACEFUL_TIMEOUT,
+        # requests are written to the access log by the app itself
+        access_log=False,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Production server")
+    parser.add_argument(
+        "command", nargs="?", choices=("serve", "migrate"), default="serve"
+    )
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY)
+    parser.add_argument(
+        "--no-migrate", dest="migrate", action="store_false", default=SERVE_MIGRATE
+    )
+    args = parser.parse_args()
+
+    if args.command == "migrate" or args.migrate:
+        migrate()
+    if args.command == "serve":
+        serve(args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession
+
+load_dotenv()
+
+from src.db_services import TweetService, FollowersService, UserService
+from src.models import Tweets
+
+TIMELINE_FANOUT = os.getenv("TIMELINE_FANOUT", "false").lower() == "true"
+TIMELINE_MAX_LENGTH = int(os.getenv("TIMELINE_MAX_LENGTH", 800))
+
+# (created_at, tweet id) - the same key the feed cursor is built from
+TimelineEntry = Tuple[datetime, int]
+
+
+class TimelineStore(ABC):
+    """Materialized home timelines, newest entries first.
+
+    Only timelines that have been built with ``replace`` are kept up to date
+    by ``push``, so a missing timeline is always rebuilt from the database
+    instead of being served partially.
+    """
+
+    @abstractmethod
+    async def exists(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def users(self) -> List[int]:
+        """Ids of the users whose timelines are built."""
+
+    @abstractmethod
+    async def get(
+        self, user_id: int, limit: int, before: Optional[TimelineEntry] = None
+    ) -> Optional[List[TimelineEntry]]:
+        """Return up to ``limit`` entries older than ``before``.
+
+        ``None`` means the store cannot answer: the timeline is not built or
+        the page reaches past the entries trimmed off its tail.
+        """
+
+    @abstractmethod
+    async def replace(
+        self, user_id: int, entries: Iterable[TimelineEntry], complete: bool
+    ) -> None: ...
+
+    @abstractmethod
+    async def push(self, user_ids: Iterable[int], entry: TimelineEntry) -> None: ...
+
+    @abstractmethod
+    async def remove(self, user_ids: Iterable[int], tweet_id: int) -> None: ...
+
+    @abstractmethod
+    async def discard(self, user_id: int) -> None: ...
+
+
+class MemoryTimelineStore(TimelineStore):
+    def __init__(self, max_length: int):
+        self.max_length = max_length
+        # entries are kept in ascending order so bisect works on them directly
+        self._timelines: Dict[int, List[TimelineEntry]] = {}
+        self._truncated: Set[int] = set()
+
+    async def exists(self, user_id: int) -> bool:
+        return user_id in self._timelines
+
+    async def users(self) -> List[int]:
+        return list(self._timelines)
+
+    async def get(
+        self, user_id: int, limit: int, before: Optional[TimelineEntry] = None
+    ) -> Optional[List[TimelineEntry]]:
+        timeline = self._timelines.get(user_id)
+        if timeline is None:
+            return None
+        end = len(timeline) if before is None else bisect_left(timeline, before)
+        entries = timeline[max(end - limit, 0) : end][::-1]
+        if len(entries) < limit and user_id in self._truncated:
+            return None
+        return entries
+
+    async def replace(
+        self, user_id: int, entries: Iterable[TimelineEntry], complete: bool
+    ) -> None:
+        timeline = sorted(entries)
+        if len(timeline) > self.max_length:
+            timeline = timeline[-self.max_length :]
+            complete = False
+        self._timelines[user_id] = timeline
+        if complete:
+            self._truncated.discard(user_id)
+        else:
+            self._truncated.add(user_id)
+
+    async def push(self, user_ids: Iterable[int], entry: TimelineEntry) -> None:
+        for user_id in user_ids:
+            timeline = self._timelines.get(user_id)
+            if timeline is None:
+                continue
+            insort(timeline, entry)
+            if len(timeline) > self.max_length:
+                del timeline[0]
+                self._truncated.add(user_id)
+
+    async def remove(self, user_ids: Iterable[int], tweet_id: int) -> None:
+        for user_id in user_ids:
+            timeline = self._timelines.get(user_id)
+            if timeline is not None:
+                timeline[:] = [entry for entry in timeline if entry[1] != tweet_id]
+
+    async def discard(self, user_id: int) -> None:
+        self._timelines.pop(user_id, None)
+        self._truncated.discard(user_id)
+
+
+timeline_store = MemoryTimelineStore(TIMELINE_MAX_LENGTH)
+# set by request_rebuild, e.g. on SIGHUP; the server runs the rebuild
+rebuild_requested = asyncio.Event()
+
+
+async def rebuild_timeline(
+    session: AsyncSession, user_id: int, store: TimelineStore = timeline_store
+) -> None:
+    entries = await TweetService.get_timeline_entries(
+        session, user_id, TIMELINE_MAX_LENGTH + 1
+    )
+    await store.replace(
+        user_id, entries[:TIMELINE_MAX_LENGTH], len(entries) <= TIMELINE_MAX_LENGTH
+    )
+
+
+async def rebuild_timelines(
+    session: AsyncSession,
+    user_ids: Optional[List[int]] = None,
+    store: TimelineStore = timeline_store,
+) -> int:
+    if user_ids is None:
+        user_ids = await UserService.get_users_ids(session)
+    for user_id in user_ids:
+        await rebuild_timeline(session, user_id, store)
+    return len(user_ids)
+
+
+def request_rebuild() -> None:
+    rebuild_requested.set()
+
+
+async def rebuild_stored_timelines(
+    session: AsyncSession, store: TimelineStore = timeline_store
+) -> int:
+    """Regenerate every built timeline, e.g. after it drifted from the database.
+
+    Timelines that are not built are left to be rebuilt on first read.
+    """
+    return await rebuild_timelines(session, await store.users(), store)
+
+
+async def get_timeline_versions(
+    session: AsyncSession,
+    user_id: int,
+    limit: int,
+    cursor: Optional[TimelineEntry] = None,
+    store: TimelineStore = timeline_store,
+) -> List[Tuple[int, int]]:
+    """(tweet id, likes version) of a timeline page, without loading the tweets."""
+    entries = await store.get(user_id, limit, cursor)
+    if entries is None and not await store.exists(user_id):
+        await rebuild_timeline(session, user_id, store)
+        entries = await store.get(user_id, limit, cursor)
+    if entries is None:
+        return await TweetService.get_feed_versions(session, user_id, limit, cursor)
+    return await TweetService.get_versions_by_ids(session, [id for _, id in entries])
+
+
+async def fan_out_tweet(
+    session: AsyncSession, tweet: Tweets, store: TimelineStore = timeline_store
+) -> None:
+    followers_ids = await FollowersService.get_followers_ids(session, tweet.author)
+    await store.push(followers_ids, (tweet.created_at, tweet.id))
+
+
+async def remove_tweet(
+    session: AsyncSession,
+    author: int,
+    tweet_id: int,
+    store: TimelineStore = timeline_store,
+) -> None:
+    followers_ids = await FollowersService.get_followers_ids(session, author)
+    await store.remove(followers_ids, tweet_id)
@@ -0,0 +1,49 @@
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession
+
+load_dotenv()
+
+from src.db_services import LikesService, MediaService, TweetService
+from src.media_storage import discard_upload, legacy_media_path
+
+TWEET_PURGE_INTERVAL = float(os.getenv("TWEET_PURGE_INTERVAL", 60))
+TWEET_PURGE_BATCH = int(os.getenv("TWEET_PURGE_BATCH", 100))
+TWEET_PURGE_CHUNK = int(os.getenv("TWEET_PURGE_CHUNK", 1000))
+
+# set by deletes so the purger does not wait for the next interval
+purge_requested = asyncio.Event()
+
+
+async def purge_tweet(session: AsyncSession, tweet_id: int) -> None:
+    """Delete a soft-deleted tweet together with its likes and media.
+
+    Likes go in chunks of TWEET_PURGE_CHUNK, each in its own transaction, so a
+    tweet with a huge number of likes never holds locks for long. Blobs are
+    only released here, the media sweeper removes their files once nothing
+    references them.
+    """
+    while await LikesService.delete_likes_chunk(session, tweet_id, TWEET_PURGE_CHUNK):
+        await session.commit()
+    media = await MediaService.delete_tweet_media(session, tweet_id)
+    await MediaService.release_blobs(session, [blob for _, _, blob in media if blob])
+    await TweetService.purge_tweet(session, tweet_id)
+    await session.commit()
+    discard_upload(
+        *(legacy_media_path(id, extension) for id, extension, blob in media if not blob)
+    )
+
+
+async def purge_deleted_tweets(session: AsyncSession) -> int:
+    purged = 0
+    while tweet_ids := await TweetService.get_deleted_ids(session, TWEET_PURGE_BATCH):
+        for tweet_id in tweet_ids:
+            await purge_tweet(session, tweet_id)
+        purged += len(tweet_ids)
+    return purged
+
+
+def request_purge() -> None:
+    purge_requested.set()
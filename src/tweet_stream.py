@@ -0,0 +1,210 @@
+"""Push of new tweets and like-count changes to connected followers.
+
+``GET /api/tweets/stream`` keeps a server-sent events connection open and
+sends every event about the authors the user follows:
+
+    event: tweet       data: {"id": 42, "author": 7}
+    event: likes       data: {"id": 42, "delta": 1}
+    event: delete      data: {"id": 42}
+
+The pub/sub is in-process, so a worker only pushes what was written through
+it. An event is encoded once and the same bytes are queued for every
+subscriber. A subscriber holds at most STREAM_QUEUE_SIZE pending events and
+a send may take at most STREAM_SEND_TIMEOUT seconds; a consumer that falls
+behind either way is disconnected, and its client is expected to reconnect
+and reload the feed. An idle connection costs a subscriber and a task
+waiting for the disconnect, about 25 KB of a worker's memory with the
+server's own buffers.
+"""
+
+import asyncio
+import os
+from collections import deque
+from http import HTTPStatus
+from typing import Dict, Iterable, List, Set
+
+import orjson
+from dotenv import load_dotenv
+from fastapi import Response
+
+load_dotenv()
+
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", 256))
+STREAM_SEND_TIMEOUT = float(os.getenv("STREAM_SEND_TIMEOUT", 10))
+# comments sent on idle connections keep proxies from closing them
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", 30))
+# connections are closed after this long so that clients spread over the
+# workers again and a graceful shutdown does not wait for them forever
+STREAM_MAX_AGE = float(os.getenv("STREAM_MAX_AGE", 600))
+STREAM_RETRY = int(os.getenv("STREAM_RETRY", 3000))
+
+HEARTBEAT = b": ping\n\n"
+
+
+def encode_event(name: str, data: dict) -> bytes:
+    return b"event: %s\ndata: %s\n\n" % (name.encode(), orjson.dumps(data))
+
+
+class Subscriber:
+    __slots__ = ("user_id", "following", "events", "ready", "closed", "overflowed")
+
+    def __init__(self, user_id: int, following: Iterable[int]):
+        self.user_id = user_id
+        self.following = set(following)
+        self.events: deque = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.overflowed = False
+
+    def push(self, event: bytes) -> None:
+        if self.closed:
+            return
+        if len(self.events) >= STREAM_QUEUE_SIZE:
+            self.overflowed = True
+            self.close()
+            return
+        self.events.append(event)
+        self.ready.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self.ready.set()
+
+    async def next_events(self, timeout: float) -> List[bytes]:
+        """Wait up to ``timeout`` seconds and take all pending events."""
+        if not self.events and not self.closed:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self.ready.clear()
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+
+class TweetStream:
+    def __init__(self):
+        self._by_author: Dict[int, Set[Subscriber]] = {}
+        self._by_user: Dict[int, Set[Subscriber]] = {}
+        self.published = 0
+        self.slow_disconnects = 0
+
+    def __len__(self) -> int:
+        return sum(len(subscribers) for subscribers in self._by_user.values())
+
+    def subscribe(self, user_id: int, following: Iterable[int]) -> Subscriber:
+        subscriber = Subscriber(user_id, following)
+        self._by_user.setdefault(user_id, set()).add(subscriber)
+        for author in subscriber.following:
+            self._by_author.setdefault(author, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscriber.close()
+        if subscriber.overflowed:
+            self.slow_disconnects += 1
+        self._discard(self._by_user, subscriber.user_id, subscriber)
+        for author in subscriber.following:
+            self._discard(self._by_author, author, subscriber)
+
+    def follow(self, user_id: int, authors: Iterable[int]) -> None:
+        for subscriber in self._by_user.get(user_id, ()):
+            for author in authors:
+                subscriber.following.add(author)
+                self._by_author.setdefault(author, set()).add(subscriber)
+
+    def unfollow(self, user_id: int, authors: Iterable[int]) -> None:
+        for subscriber in self._by_user.get(user_id, ()):
+            for author in authors:
+                subscriber.following.discard(author)
+                self._discard(self._by_author, author, subscriber)
+
+    def publish(self, author: int, name: str, data: dict) -> None:
+        subscribers = self._by_author.get(author)
+        if not subscribers:
+            return
+        event = encode_event(name, data)
+        # a push may close a slow subscriber, which changes the set
+        for subscriber in list(subscribers):
+            subscriber.push(event)
+        self.published += 1
+
+    def close_all(self) -> None:
+        for subscribers in self._by_user.values():
+            for subscriber in subscribers:
+                subscriber.close()
+
+    @staticmethod
+    def _discard(index: Dict[int, Set[Subscriber]], key: int, subscriber) -> None:
+        subscribers = index.get(key)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del index[key]
+
+
+tweet_stream = TweetStream()
+
+
+class EventStreamResponse(Response):
+    """Server-sent events of one subscriber, until either side stops."""
+
+    media_type = "text/event-stream"
+
+    def __init__(
+        self,
+        user_id: int,
+        following: Iterable[int],
+        stream: TweetStream = tweet_stream,
+    ):
+        self.status_code = HTTPStatus.OK
+        self.background = None
+        # without a body no content-length is set; nginx would otherwise
+        # buffer the events of the proxied response
+        self.init_headers({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        self.user_id = user_id
+        self.following = following
+        self.stream = stream
+
+    async def _send(self, send, body: bytes, more_body: bool = True) -> None:
+        message = {"type": "http.response.body", "body": body, "more_body": more_body}
+        await asyncio.wait_for(send(message), STREAM_SEND_TIMEOUT)
+
+    @staticmethod
+    async def _watch_disconnect(receive, subscriber: Subscriber) -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        subscriber.close()
+
+    async def __call__(self, scope, receive, send) -> None:
+        subscriber = self.stream.subscribe(self.user_id, self.following)
+        watcher = asyncio.create_task(self._watch_disconnect(receive, subscriber))
+        deadline = asyncio.get_running_loop().time() + STREAM_MAX_AGE
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            await self._send(send, b"retry: %d\n\n" % STREAM_RETRY)
+            while not subscriber.closed:
+                remaining = deadline - asyncio.get_running_loop().time()
+                if remaining <= 0:
+                    break
+                events = await subscriber.next_events(min(STREAM_HEARTBEAT, remaining))
+                if subscriber.overflowed:
+                    # the backlog is dropped, the client reloads the feed
+                    # when it reconnects
+                    break
+                await self._send(send, b"".join(events) or HEARTBEAT)
+            await self._send(send, b"", more_body=False)
+        except asyncio.TimeoutError:
+            # the client stopped reading; returning without finishing the
+            # response makes the server drop the connection
+            subscriber.overflowed = True
+        finally:
+            watcher.cancel()
+            self.stream.unsubscribe(subscriber)
@@ -1,7 +1,9 @@
 import factory
 from factory.alchemy import SQLAlchemyModelFactory
 from src.models import Users, Tweets, Media, Followers, Likes
-from src.main import session
+from src.database import async_session
+
+session = async_session()
 
 
 class UserFactory(SQLAlchemyModelFactory):
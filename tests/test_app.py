@@ -1,9 +1,14 @@
+import asyncio
+from datetime import datetime, timezone
 import pytest
 from httpx import AsyncClient
-from .factories import UserFactory, TweetFactory, MediaFactory, LikesFactory, FollowersFactory
-from src.main import session
+from .factories import UserFactory, TweetFactory, MediaFactory, LikesFactory, FollowersFactory, session
+from src.main import app, engine
+from src.database import async_session, get_session
+from src.pagination import encode_cursor
 from src.models import Likes, Followers
 from sqlalchemy.future import select
+from sqlalchemy import event
 
 
 @pytest.mark.asyncio
@@ -246,3 +251,327 @@ async def test_user_page_get_error_wrong_api_key(ac: AsyncClient, init_db, logge
 
     assert response.status_code == 400
     assert response.json()["error"] == 'Sorry. Wrong api-key token in headers. This user does not exist.'
+
+
+@pytest.mark.asyncio
+async def test_tweets_get_query_count(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    session.add(test_user)
+    await session.commit()
+    authors = [UserFactory.create() for _ in range(3)]
+    likers = [UserFactory.create() for _ in range(5)]
+    session.add_all(authors + likers)
+    await session.commit()
+    for author in authors:
+        session.add(FollowersFactory(user_id=test_user.id, follower_id=author.id))
+    await session.commit()
+
+    queries = []
+
+    def count_queries(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    async def add_tweets(count):
+        for author in authors:
+            for _ in range(count):
+                tweet = TweetFactory.create(author=author.id)
+                session.add(tweet)
+                await session.commit()
+                session.add(MediaFactory.create(tweet_id=tweet.id))
+                for liker in likers:
+                    session.add(LikesFactory(tweet_id=tweet.id, user_id=liker.id))
+                await session.commit()
+
+    async def feed_queries():
+        queries.clear()
+        event.listen(engine.sync_engine, "before_cursor_execute", count_queries)
+        try:
+            response = await ac.get("/api/tweets", headers=headers)
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", count_queries)
+        assert response.status_code == 200
+        return len(response.json()["tweets"]), len(queries)
+
+    headers = {"api-key": test_user.api_key}
+    await add_tweets(1)
+    # the first request also authenticates against the database
+    await feed_queries()
+    small_feed, small_queries = await feed_queries()
+    await add_tweets(4)
+    large_feed, large_queries = await feed_queries()
+
+    assert small_feed == 3
+    assert large_feed == 15
+    assert large_queries == small_queries
+    assert large_queries <= 10
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_use_separate_connections(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    session.add(test_user)
+    await session.commit()
+
+    concurrency = 5
+    barrier = asyncio.Barrier(concurrency)
+    connections = []
+
+    async def get_session_override():
+        async with async_session() as request_session:
+            connection = await request_session.connection()
+            raw_connection = await connection.get_raw_connection()
+            connections.append(raw_connection.driver_connection)
+            await barrier.wait()
+            yield request_session
+
+    app.dependency_overrides[get_session] = get_session_override
+    try:
+        headers = {"api-key": test_user.api_key}
+        responses = await asyncio.gather(
+            *[ac.get("/api/users/me", headers=headers) for _ in range(concurrency)]
+        )
+    finally:
+        app.dependency_overrides.pop(get_session)
+
+    assert all(response.status_code == 200 for response in responses)
+    assert len({id(connection) for connection in connections}) == concurrency
+
+
+@pytest.mark.asyncio
+async def test_tweets_get_pagination(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    test_user2 = UserFactory.create()
+    session.add(test_user)
+    session.add(test_user2)
+    await session.commit()
+    session.add(FollowersFactory(user_id=test_user.id, follower_id=test_user2.id))
+    await session.commit()
+    test_tweets = [TweetFactory.create(author=test_user2.id) for _ in range(5)]
+    session.add_all(test_tweets)
+    await session.commit()
+
+    headers = {"api-key": test_user.api_key}
+    pages = []
+    params = {"limit": 2}
+    while True:
+        response = await ac.get("/api/tweets", headers=headers, params=params)
+        assert response.status_code == 200
+        pages.append([tweet["id"] for tweet in response.json()["tweets"]])
+        if response.json()["next_cursor"] is None:
+            break
+        params["cursor"] = response.json()["next_cursor"]
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sum(pages, []) == sorted((tweet.id for tweet in test_tweets), reverse=True)
+
+
+@pytest.mark.asyncio
+async def test_tweets_get_invalid_cursor(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    session.add(test_user)
+    await session.commit()
+
+    headers = {"api-key": test_user.api_key}
+    aware = encode_cursor(datetime(2024, 1, 1, tzinfo=timezone.utc), 1)
+    for cursor in ("broken", aware):
+        response = await ac.get("/api/tweets", headers=headers, params={"cursor": cursor})
+        assert response.status_code == 400
+        assert response.json()["error"] == "Invalid cursor."
+
+
+@pytest.mark.asyncio
+async def test_like_and_follow_counters(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    test_user2 = UserFactory.create()
+    session.add(test_user)
+    session.add(test_user2)
+    await session.commit()
+    test_tweet = TweetFactory.create(author=test_user2.id)
+    session.add(test_tweet)
+    await session.commit()
+    headers = {"api-key": test_user.api_key}
+
+    await ac.post(f"/api/users/{test_user2.id}/follow", headers=headers)
+    await ac.post(f"/api/tweets/{test_tweet.id}/likes", headers=headers)
+    await session.refresh(test_user)
+    await session.refresh(test_user2)
+    await session.refresh(test_tweet)
+    assert test_tweet.like_count == 1
+    assert (test_user.following_count, test_user.follower_count) == (1, 0)
+    assert (test_user2.following_count, test_user2.follower_count) == (0, 1)
+
+    await ac.delete(f"/api/tweets/{test_tweet.id}/likes", headers=headers)
+    await ac.delete(f"/api/users/{test_user2.id}/follow", headers=headers)
+    await session.refresh(test_user)
+    await session.refresh(test_user2)
+    await session.refresh(test_tweet)
+    assert test_tweet.like_count == 0
+    assert test_user.following_count == 0
+    assert test_user2.follower_count == 0
+
+
+@pytest.mark.asyncio
+async def test_repeated_likes_and_follows(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    test_user2 = UserFactory.create()
+    session.add_all([test_user, test_user2])
+    await session.commit()
+    test_tweet = TweetFactory.create(author=test_user2.id)
+    session.add(test_tweet)
+    await session.commit()
+    headers = {"api-key": test_user.api_key}
+    like_url = f"/api/tweets/{test_tweet.id}/likes"
+    follow_url = f"/api/users/{test_user2.id}/follow"
+
+    responses = await asyncio.gather(
+        *(ac.post(like_url, headers=headers) for _ in range(3))
+    )
+    assert sorted(r.status_code for r in responses) == [200, 400, 400]
+    response = await ac.post(like_url, headers=headers)
+    assert response.json() == {"error": "You have already liked this tweet."}
+    await session.refresh(test_tweet)
+    assert test_tweet.like_count == 1
+
+    assert (await ac.delete(like_url, headers=headers)).status_code == 200
+    response = await ac.delete(like_url, headers=headers)
+    assert response.json() == {"error": "You have not liked this tweet."}
+    response = await ac.post("/api/tweets/100000/likes", headers=headers)
+    assert response.json() == {"error": "No such tweet in database."}
+    response = await ac.delete("/api/tweets/100000/likes", headers=headers)
+    assert response.json() == {"error": "No such tweet in database."}
+
+    assert (await ac.post(follow_url, headers=headers)).status_code == 200
+    response = await ac.post(follow_url, headers=headers)
+    assert response.json() == {
+        "error": "Sorry. You have been already following this user."
+    }
+    response = await ac.post("/api/users/100000/follow", headers=headers)
+    assert response.json() == {"error": "No such user in database."}
+    assert (await ac.delete(follow_url, headers=headers)).status_code == 200
+    response = await ac.delete(follow_url, headers=headers)
+    assert response.json() == {"error": "Sorry. You are not following this user."}
+    await session.refresh(test_user2)
+    assert test_user2.follower_count == 0
+
+
+@pytest.mark.asyncio
+async def test_batch_likes_and_follows(ac: AsyncClient, init_db, logger, monkeypatch):
+    test_user = UserFactory.create()
+    authors = [UserFactory.create() for _ in range(2)]
+    session.add_all([test_user] + authors)
+    await session.commit()
+    tweets = [TweetFactory.create(author=author.id) for author in authors]
+    session.add_all(tweets)
+    await session.commit()
+    headers = {"api-key": test_user.api_key}
+    first, second = tweets
+    await ac.post(f"/api/tweets/{second.id}/likes", headers=headers)
+
+    response = await ac.post(
+        "/api/likes:batch",
+        headers=headers,
+        json={
+            "operations": [
+                {"tweet_id": first.id},
+                {"tweet_id": second.id, "action": "unlike"},
+                {"tweet_id": first.id, "action": "unlike"},
+                {"tweet_id": 100000},
+            ]
+        },
+    )
+    assert response.status_code == 200
+    assert [(r["result"], r["error"]) for r in response.json()["results"]] == [
+        (True, None),
+        (True, None),
+        (False, "Duplicate operation in batch."),
+        (False, "No such tweet in database."),
+    ]
+    await session.refresh(first)
+    await session.refresh(second)
+    assert (first.like_count, second.like_count) == (1, 0)
+
+    operations = [{"user_id": author.id} for author in authors]
+    operations += [
+        {"user_id": test_user.id},
+        {"user_id": 100000, "action": "unfollow"},
+    ]
+    response = await ac.post(
+        "/api/follows:batch", headers=headers, json={"operations": operations}
+    )
+    assert [(r["result"], r["error"]) for r in response.json()["results"]] == [
+        (True, None),
+        (True, None),
+        (False, "Sorry. You cannot follow yourself."),
+        (False, "Sorry. You are not following this user."),
+    ]
+    await session.refresh(test_user)
+    await session.refresh(authors[0])
+    assert test_user.following_count == 2
+    assert authors[0].follower_count == 1
+
+    monkeypatch.setattr("src.main.BATCH_MAX_OPERATIONS", 1)
+    response = await ac.post(
+        "/api/follows:batch", headers=headers, json={"operations": operations}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_preview_mode(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    test_user2 = UserFactory.create()
+    fans = [UserFactory.create() for _ in range(4)]
+    session.add_all([test_user, test_user2] + fans)
+    await session.commit()
+    test_tweet = TweetFactory.create(author=test_user2.id)
+    session.add(test_tweet)
+    await session.commit()
+    await ac.post(
+        f"/api/users/{test_user2.id}/follow", headers={"api-key": test_user.api_key}
+    )
+    for fan in fans:
+        headers = {"api-key": fan.api_key}
+        await ac.post(f"/api/users/{test_user2.id}/follow", headers=headers)
+        await ac.post(f"/api/tweets/{test_tweet.id}/likes", headers=headers)
+
+    headers = {"api-key": test_user.api_key}
+    response = await ac.get("/api/tweets", headers=headers, params={"preview": 2})
+    tweet = response.json()["tweets"][0]
+    assert tweet["like_count"] == 4
+    assert [like["user_id"] for like in tweet["likes"]] == [fan.id for fan in fans[:2]]
+
+    response = await ac.get(f"/api/users/{test_user2.id}", headers=headers, params={"preview": 2})
+    user = response.json()["user"]
+    assert user["follower_count"] == 5
+    assert len(user["followers"]) == 2
+
+    response = await ac.get(f"/api/users/{test_user2.id}", headers=headers)
+    assert len(response.json()["user"]["followers"]) == 5
+
+
+@pytest.mark.asyncio
+async def test_followers_pagination(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    fans = [UserFactory.create() for _ in range(5)]
+    session.add_all([test_user] + fans)
+    await session.commit()
+    for fan in fans:
+        session.add(FollowersFactory(user_id=fan.id, follower_id=test_user.id))
+        session.add(FollowersFactory(user_id=test_user.id, follower_id=fan.id))
+    await session.commit()
+    headers = {"api-key": test_user.api_key}
+
+    for relation in ("followers", "following"):
+        pages = []
+        params = {"limit": 2}
+        while True:
+            response = await ac.get(
+                f"/api/users/{test_user.id}/{relation}", headers=headers, params=params
+            )
+            assert response.status_code == 200
+            pages.append([user["id"] for user in response.json()["users"]])
+            if response.json()["next_cursor"] is None:
+                break
+            params["cursor"] = response.json()["next_cursor"]
+        assert [len(page) for page in pages] == [2, 2, 1]
+        assert sum(pages, []) == [fan.id for fan in fans]
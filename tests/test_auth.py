@@ -0,0 +1,64 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import event
+
+from .factories import UserFactory, session
+from src.auth import auth_cache
+from src.cache import TTLCache
+from src.main import engine
+
+
+def test_ttl_cache_expires_and_evicts():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    # "b" is the least recently used entry
+    assert cache.get("b") is None
+    now[0] = 11
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+@pytest.mark.asyncio
+async def test_api_key_is_cached(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    session.add(test_user)
+    await session.commit()
+    headers = {"api-key": test_user.api_key}
+    queries = []
+
+    def count_queries(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    response = await ac.get("/api/users/me", headers=headers)
+    assert response.status_code == 200
+    hits = auth_cache.hits
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_queries)
+    try:
+        response = await ac.get("/api/users/me", headers=headers)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count_queries)
+    assert response.status_code == 200
+    assert auth_cache.hits == hits + 1
+    assert not any("WHERE users.api_key" in query for query in queries)
+
+
+@pytest.mark.asyncio
+async def test_api_key_cache_invalidated_on_update(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    session.add(test_user)
+    await session.commit()
+    headers = {"api-key": test_user.api_key}
+
+    response = await ac.get("/api/users/me", headers=headers)
+    assert auth_cache.get(test_user.api_key) is not None
+
+    test_user.name = "Renamed"
+    await session.commit()
+    assert auth_cache.get(test_user.api_key) is None
+    response = await ac.get("/api/users/me", headers=headers)
+    assert response.json()["user"]["name"] == "Renamed"
@@ -0,0 +1,135 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.benchmark import (
+    Graph,
+    GraphConfig,
+    Workload,
+    benchmark_serialization,
+    compare,
+    percentile,
+    seed_graph,
+)
+from src.models import Followers, Likes, Tweets, Users
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_percentile_interpolates():
+    values = [1.0, 2.0, 3.0, 4.0]
+    assert percentile(values, 50) == 2.5
+    assert percentile(values, 100) == 4.0
+    assert percentile([], 99) == 0.0
+
+
+def test_compare_flags_regressions():
+    def report(p95, throughput, queries, errors=0):
+        latency = {"p50": 1.0, "p95": p95, "p99": p95, "max": p95}
+        return {
+            "scenarios": {
+                "feed": {
+                    "latency_ms": latency,
+                    "throughput_rps": throughput,
+                    "queries_per_request": queries,
+                    "errors": errors,
+                }
+            }
+        }
+
+    baseline = report(10.0, 100.0, 3.0)
+    assert compare(baseline, report(10.5, 95.0, 3.0)) == []
+    regressions = compare(baseline, report(20.0, 50.0, 4.0, errors=1))
+    assert len(regressions) == 5
+    assert any("queries per request 3.0 -> 4.0" in line for line in regressions)
+
+
+@pytest.mark.asyncio
+async def test_seed_graph_keeps_counters_consistent(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/bench.db")
+    config = GraphConfig(users=20, fanout=3, tweets=2, likes=4, seed=7)
+    graph = await seed_graph(config, engine)
+    async with engine.connect() as conn:
+        assert await conn.scalar(select(func.count()).select_from(Followers)) == 60
+        assert await conn.scalar(select(func.count()).select_from(Tweets)) == 40
+        assert await conn.scalar(select(func.count()).select_from(Likes)) == 160
+        assert await conn.scalar(select(func.sum(Users.following_count))) == 60
+        assert await conn.scalar(select(func.sum(Users.follower_count))) == 60
+        assert await conn.scalar(select(func.sum(Tweets.like_count))) == 160
+    assert len(graph.likes) == 160
+
+    with pytest.raises(RuntimeError):
+        await seed_graph(config, engine)
+    again = await seed_graph(config, engine, reset=True)
+    assert again.likes == graph.likes
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_serialization_benchmark_compares_identical_bodies():
+    report = await benchmark_serialization(tweets=5, likes=2, iterations=2)
+    assert set(report["ms_per_response"]) == {"response_model", "orjson"}
+    assert report["response_bytes"] > 0
+
+
+def test_like_falls_back_to_a_read_once_everything_is_liked():
+    graph = Graph([1], {1: "key"}, [10, 11], {(10, 1)})
+    workload = Workload(graph, seed=1)
+    assert workload.request("like", 0)["url"] == "/api/tweets/11/likes"
+    assert workload.request("like", 1) == {
+        "method": "GET",
+        "url": "/api/tweets",
+        "headers": {"api-key": "key"},
+    }
+
+
+def test_run_likes_more_than_the_graph_holds(tmp_path):
+    # 3 users and 3 tweets leave at most 9 likes, far fewer than requested
+    env = {
+        **os.environ,
+        "ENV": "production",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{tmp_path}/bench.db",
+        "DATABASE_URL_REPLICAS": "",
+        "LOG_FILE": str(tmp_path / "log" / "app.log"),
+        "ACCESS_LOG_FILE": str(tmp_path / "log" / "access.log"),
+        "MEDIA_ROOT": str(tmp_path / "storage"),
+    }
+    output = tmp_path / "run.json"
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "src.benchmark",
+            "run",
+            "--users",
+            "3",
+            "--fanout",
+            "1",
+            "--tweets",
+            "1",
+            "--likes",
+            "0",
+            "--requests",
+            "30",
+            "--concurrency",
+            "4",
+            "--scenario",
+            "like",
+            "--output",
+            str(output),
+        ],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        check=True,
+        timeout=120,
+    )
+    like = json.loads(output.read_text())["scenarios"]["like"]
+    assert like["requests"] == 30
+    assert like["errors"] == 0
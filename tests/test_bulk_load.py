@@ -0,0 +1,74 @@
+import json
+
+import pytest
+from sqlalchemy import func, inspect, select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.bulk_load import bulk_load, read_source
+from src.models import Base, Followers, Tweets, Users
+
+
+@pytest.fixture
+async def bulk_engine(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/bulk.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    yield engine
+    await engine.dispose()
+
+
+def write_sources(tmp_path, follows):
+    users = tmp_path / "users.csv"
+    users.write_text("id,name,api_key\n1,Ann,key-1\n2,Bob,key-2\n3,Eve,key-3\n")
+    tweets = tmp_path / "tweets.jsonl"
+    tweets.write_text(
+        json.dumps(
+            {"id": 1, "author": 2, "content": "hi", "created_at": "2024-01-01T10:00:00"}
+        )
+        + "\n"
+    )
+    followers = tmp_path / "follows.csv"
+    followers.write_text(
+        "user_id,follower_id\n" + "".join(f"{a},{b}\n" for a, b in follows)
+    )
+    return {
+        "users": read_source(str(users), Base.metadata.tables["users"]),
+        "tweets": read_source(str(tweets), Base.metadata.tables["tweets"]),
+        "followers": read_source(str(followers), Base.metadata.tables["followers"]),
+    }
+
+
+@pytest.mark.asyncio
+async def test_bulk_load_from_files(tmp_path, bulk_engine):
+    sources = write_sources(tmp_path, [(1, 2), (3, 2), (2, 1)])
+    counts = await bulk_load(sources, bulk_engine, batch_size=2)
+    assert counts == {"users": 3, "tweets": 1, "followers": 3}
+
+    async with bulk_engine.connect() as conn:
+        counters = (
+            await conn.execute(
+                select(Users.id, Users.follower_count, Users.following_count).order_by(
+                    Users.id
+                )
+            )
+        ).all()
+        assert counters == [(1, 1, 1), (2, 2, 1), (3, 0, 1)]
+        tweet = (await conn.execute(select(Tweets.author, Tweets.created_at))).one()
+        assert tweet.author == 2 and tweet.created_at.year == 2024
+        indexes = await conn.run_sync(
+            lambda sync_conn: inspect(sync_conn).get_indexes("followers")
+        )
+        assert [index["name"] for index in indexes] == [
+            "ix_followers_user_id_follower_id"
+        ]
+
+
+@pytest.mark.asyncio
+async def test_bulk_load_rolls_back_on_missing_reference(tmp_path, bulk_engine):
+    sources = write_sources(tmp_path, [(1, 2), (1, 42)])
+    with pytest.raises(ValueError, match="followers"):
+        await bulk_load(sources, bulk_engine)
+
+    async with bulk_engine.connect() as conn:
+        assert await conn.scalar(select(func.count()).select_from(Followers)) == 0
+        assert await conn.scalar(select(func.count()).select_from(Users)) == 0
@@ -1,9 +1,8 @@
 import pytest
 
-from .factories import UserFactory, TweetFactory, MediaFactory, LikesFactory, FollowersFactory
+from .factories import UserFactory, TweetFactory, MediaFactory, LikesFactory, FollowersFactory, session
 from src.models import Likes, Followers, Users, Tweets, Media
 from httpx import AsyncClient
-from src.main import session
 from sqlalchemy.future import select
 
 
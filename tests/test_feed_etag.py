@@ -0,0 +1,71 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import event
+
+from .factories import UserFactory, TweetFactory, FollowersFactory, session
+from src.main import engine
+
+
+@pytest.mark.asyncio
+async def test_unchanged_feed_is_answered_with_304(ac: AsyncClient, init_db, logger):
+    reader = UserFactory.create()
+    author = UserFactory.create()
+    fans = [UserFactory.create() for _ in range(2)]
+    session.add_all([reader, author] + fans)
+    await session.commit()
+    session.add(FollowersFactory(user_id=reader.id, follower_id=author.id))
+    tweet = TweetFactory.create(author=author.id)
+    session.add(tweet)
+    await session.commit()
+    headers = {"api-key": reader.api_key}
+
+    response = await ac.get("/api/tweets", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+
+    queries = []
+
+    def count_queries(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_queries)
+    try:
+        response = await ac.get(
+            "/api/tweets", headers={**headers, "if-none-match": etag}
+        )
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count_queries)
+    assert response.status_code == 304
+    assert response.content == b""
+    # only the version query, the tweets are never loaded
+    assert len(queries) == 1
+
+    response = await ac.get(
+        "/api/tweets", headers={**headers, "if-none-match": etag}, params={"preview": 1}
+    )
+    assert response.status_code == 200
+
+    async def changed():
+        nonlocal etag
+        response = await ac.get(
+            "/api/tweets", headers={**headers, "if-none-match": etag}
+        )
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        return response.json()["tweets"]
+
+    await ac.post(f"/api/tweets/{tweet.id}/likes", headers={"api-key": fans[0].api_key})
+    assert (await changed())[0]["like_count"] == 1
+    # one like replaced by another leaves like_count as it was
+    await ac.delete(
+        f"/api/tweets/{tweet.id}/likes", headers={"api-key": fans[0].api_key}
+    )
+    await ac.post(f"/api/tweets/{tweet.id}/likes", headers={"api-key": fans[1].api_key})
+    assert (await changed())[0]["likes"][0]["user_id"] == fans[1].id
+
+    await ac.post(
+        "/api/tweets",
+        headers={"api-key": author.api_key},
+        json={"tweet_data": "new tweet"},
+    )
+    assert (await changed())[0]["content"] == "new tweet"
@@ -0,0 +1,91 @@
+import json
+import logging
+
+import pytest
+from httpx import AsyncClient
+
+from .factories import UserFactory, TweetFactory, FollowersFactory, session
+from src.logging_config import BatchLogger, JsonFormatter
+
+
+class Counted:
+    formatted = 0
+
+    def __str__(self):
+        Counted.formatted += 1
+        return "counted"
+
+
+@pytest.mark.asyncio
+async def test_disabled_level_is_not_formatted(tmp_path):
+    logger = BatchLogger("test", str(tmp_path / "app.log"), level=logging.INFO)
+    logger.start()
+    Counted.formatted = 0
+    logger.debug("value %s", Counted())
+    logger.info("value %s", Counted())
+    await logger.shutdown()
+
+    assert Counted.formatted == 1
+    lines = (tmp_path / "app.log").read_text().splitlines()
+    assert len(lines) == 1
+    assert lines[0].startswith("test - test_logging - test_disabled_level_is_not_formatted")
+    assert lines[0].endswith("INFO: value counted")
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_messages(tmp_path):
+    logger = BatchLogger("test", str(tmp_path / "app.log"), queue_size=10)
+    logger.start()
+    # the writer cannot run until this coroutine yields
+    for i in range(25):
+        logger.info("line %s", i)
+    await logger.shutdown()
+
+    assert logger.dropped == 15
+    assert logger.written == 10
+    assert len((tmp_path / "app.log").read_text().splitlines()) == 10
+
+
+@pytest.mark.asyncio
+async def test_failed_write_counts_as_dropped(tmp_path, monkeypatch, caplog):
+    logger = BatchLogger("test", str(tmp_path / "app.log"))
+    logger.start()
+
+    def fail(data):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(logger, "_write", fail)
+    for i in range(3):
+        logger.info("line %s", i)
+    await logger.shutdown()
+
+    assert logger.dropped == 3
+    assert logger.written == 0
+    assert "Failed to write 3 lines" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_access_log_record(ac: AsyncClient, init_db, logger, tmp_path, monkeypatch):
+    test_user = UserFactory.create()
+    test_user2 = UserFactory.create()
+    session.add(test_user)
+    session.add(test_user2)
+    await session.commit()
+    session.add(FollowersFactory(user_id=test_user.id, follower_id=test_user2.id))
+    session.add(TweetFactory.create(author=test_user2.id))
+    await session.commit()
+
+    access_logger = BatchLogger("access", str(tmp_path / "access.log"), formatter=JsonFormatter())
+    access_logger.start()
+    monkeypatch.setattr("src.main.access_logger", access_logger)
+    response = await ac.get("/api/tweets", headers={"api-key": test_user.api_key})
+    await access_logger.shutdown()
+
+    record = json.loads((tmp_path / "access.log").read_text())
+    assert record["method"] == "GET"
+    assert record["path"] == "/api/tweets"
+    assert record["status"] == 200
+    assert record["user_id"] == test_user.id
+    assert record["db_queries"] >= 3
+    assert 0 < record["db_time_ms"] <= record["latency_ms"]
+    assert record["response_size"] == len(response.content)
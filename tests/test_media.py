@@ -0,0 +1,285 @@
+import hashlib
+import io
+import resource
+import shutil
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from httpx import AsyncClient
+from PIL import Image
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from .factories import UserFactory, FollowersFactory, session
+from src.media_storage import (
+    MEDIA_ROOT,
+    blob_path,
+    sweep_blobs,
+    ensure_variants,
+    variants_dir,
+    variant_urls,
+)
+from src.models import Media, MediaBlobs
+from src.tweet_purge import purge_deleted_tweets
+
+
+async def count_media():
+    count = await session.execute(select(func.count(Media.id)))
+    return count.scalar()
+
+
+@pytest.mark.asyncio
+async def test_large_upload_is_streamed(ac: AsyncClient, init_db, logger, tmp_path, monkeypatch):
+    size = 300 * 1024 * 1024
+    monkeypatch.setattr("src.media_storage.MEDIA_MAX_SIZE", size)
+    upload = tmp_path / "large.jpg"
+    with open(upload, "wb") as f:
+        f.truncate(size)
+
+    # ru_maxrss only grows, so buffering the whole upload would show up here
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(upload, "rb") as f:
+        response = await ac.post("/api/medias", files={"file": ("large.jpg", f, "image/jpeg")})
+    peak_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    assert response.status_code == 200
+    media = await session.get(Media, response.json()["media_id"])
+    stored = blob_path(media.blob)
+    assert stored.stat().st_size == size
+    assert (peak_after - peak_before) * 1024 < 64 * 1024 * 1024
+    stored.unlink()
+
+
+@pytest.mark.asyncio
+async def test_too_large_upload_is_rejected(ac: AsyncClient, init_db, logger, monkeypatch):
+    monkeypatch.setattr("src.media_storage.MEDIA_MAX_SIZE", 1024)
+    media_before = await count_media()
+
+    file = {"file": ("test.jpg", b"x" * 2048, "image/jpeg")}
+    response = await ac.post("/api/medias", files=file)
+
+    assert response.status_code == 413
+    assert response.json()["error"] == "Sorry. The file is too large."
+    assert await count_media() == media_before
+    assert not list(MEDIA_ROOT.glob(".*.tmp"))
+
+
+@pytest.mark.asyncio
+async def test_upload_without_content_length_is_rejected(ac: AsyncClient, init_db, logger, monkeypatch):
+    monkeypatch.setattr("src.media_storage.MEDIA_MAX_SIZE", 1024)
+    media_before = await count_media()
+
+    body = (
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="test.jpg"\r\n'
+        b"Content-Type: image/jpeg\r\n\r\n" + b"x" * 2048 + b"\r\n--boundary--\r\n"
+    )
+
+    async def chunks():
+        # a generator body is sent chunked, without a Content-Length
+        for start in range(0, len(body), 512):
+            yield body[start:start + 512]
+
+    response = await ac.post(
+        "/api/medias",
+        content=chunks(),
+        headers={"content-type": "multipart/form-data; boundary=boundary"},
+    )
+
+    assert response.status_code == 413
+    assert response.json()["error"] == "Sorry. The file is too large."
+    assert await count_media() == media_before
+    assert not list(MEDIA_ROOT.glob(".*.tmp"))
+
+
+@pytest.mark.asyncio
+async def test_oversized_chunked_upload_is_rejected_early(ac: AsyncClient, init_db, logger, monkeypatch):
+    monkeypatch.setattr("src.media_storage.MEDIA_MAX_SIZE", 1024)
+    monkeypatch.setattr("src.main.UPLOAD_OVERHEAD", 1024)
+    media_before = await count_media()
+
+    body = (
+        b"--boundary\r\n"
+        b'Content-Disposition: form-data; name="file"; filename="test.jpg"\r\n'
+        b"Content-Type: image/jpeg\r\n\r\n" + b"x" * 64 * 1024 + b"\r\n--boundary--\r\n"
+    )
+    sent = 0
+
+    async def chunks():
+        nonlocal sent
+        for start in range(0, len(body), 512):
+            sent += 512
+            yield body[start:start + 512]
+
+    response = await ac.post(
+        "/api/medias",
+        content=chunks(),
+        headers={"content-type": "multipart/form-data; boundary=boundary"},
+    )
+
+    assert response.status_code == 413
+    assert response.json()["error"] == "Sorry. The file is too large."
+    # the body stops being read right after it passes the limit
+    assert sent <= 2048 + 512
+    assert await count_media() == media_before
+    assert not list(MEDIA_ROOT.glob(".*.tmp"))
+
+
+@pytest.mark.asyncio
+async def test_failed_commit_publishes_nothing(ac: AsyncClient, init_db, logger, monkeypatch):
+    published = []
+    monkeypatch.setattr("src.main.publish_upload", lambda *paths: published.append(paths))
+
+    async def failing_commit(self):
+        raise OSError("database went away")
+
+    monkeypatch.setattr("sqlalchemy.ext.asyncio.AsyncSession.commit", failing_commit)
+    content = b"content that is never committed"
+    with pytest.raises(OSError):
+        await ac.post("/api/medias", files={"file": ("lost.jpg", content, "image/jpeg")})
+    monkeypatch.undo()
+
+    assert published == []
+    assert not list(MEDIA_ROOT.glob(".*.tmp"))
+
+
+@pytest.mark.asyncio
+async def test_failed_publish_releases_the_blob(ac: AsyncClient, init_db, logger, monkeypatch):
+    def failing_publish(tmp_path, destination):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("src.main.publish_upload", failing_publish)
+    media_before = await count_media()
+    content = b"content that is never published"
+    with pytest.raises(OSError):
+        await ac.post("/api/medias", files={"file": ("lost.jpg", content, "image/jpeg")})
+
+    assert await count_media() == media_before
+    name = hashlib.sha256(content).hexdigest() + ".jpg"
+    blob = await session.get(MediaBlobs, name)
+    assert blob.ref_count == 0
+    assert not blob_path(name).exists()
+    assert not list(MEDIA_ROOT.glob(".*.tmp"))
+
+
+@pytest.mark.asyncio
+async def test_identical_uploads_share_a_blob(ac: AsyncClient, init_db, logger, monkeypatch):
+    test_user = UserFactory.create()
+    session.add(test_user)
+    await session.commit()
+    headers = {"api-key": test_user.api_key}
+
+    media_ids = []
+    for _ in range(2):
+        file = {"file": ("meme.png", b"same meme", "image/png")}
+        response = await ac.post("/api/medias", files=file)
+        media_ids.append(response.json()["media_id"])
+    first, second = [await session.get(Media, id) for id in media_ids]
+    assert first.blob == second.blob
+    assert first.to_json()["url"] == second.to_json()["url"]
+    assert first.to_json()["url"] == f"/storage/{MediaBlobs.relpath(first.blob)}"
+    blob = await session.get(MediaBlobs, first.blob)
+    assert blob.ref_count == 2
+
+    tweet_data = {"tweet_data": "Test tweet", "tweet_media_ids": media_ids}
+    response = await ac.post("/api/tweets", json=tweet_data, headers=headers)
+    response = await ac.delete(f"/api/tweets/{response.json()['id']}", headers=headers)
+    assert response.status_code == 200
+    await purge_deleted_tweets(session)
+    await session.refresh(blob)
+    assert blob.ref_count == 0
+    assert blob_path(blob.name).exists()
+
+    monkeypatch.setattr("src.media_storage.MEDIA_SWEEP_GRACE", -1)
+    assert await sweep_blobs(session) >= 1
+    assert await session.get(MediaBlobs, blob.name) is None
+    assert not blob_path(blob.name).exists()
+
+
+def png_bytes(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGBA", (width, height), (255, 0, 0, 128)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.mark.asyncio
+async def test_upload_renders_variants(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    test_user2 = UserFactory.create()
+    session.add(test_user)
+    session.add(test_user2)
+    await session.commit()
+    session.add(FollowersFactory(user_id=test_user.id, follower_id=test_user2.id))
+    await session.commit()
+
+    file = {"file": ("photo.png", png_bytes(1600, 900), "image/png")}
+    response = await ac.post("/api/medias", files=file)
+    media = await session.get(Media, response.json()["media_id"])
+    assert await ensure_variants(media.blob)
+    with Image.open(variants_dir(media.blob) / "w320.png") as image:
+        assert image.size == (320, 180)
+    with Image.open(variants_dir(media.blob) / "full.webp") as image:
+        assert image.format == "WEBP"
+
+    tweet_data = {"tweet_data": "Test tweet", "tweet_media_ids": [media.id]}
+    headers2 = {"api-key": test_user2.api_key}
+    await ac.post("/api/tweets", json=tweet_data, headers=headers2)
+    response = await ac.get("/api/tweets", headers={"api-key": test_user.api_key})
+    tweet = response.json()["tweets"][0]
+    assert tweet["attachment_variants"] == [variant_urls(media)]
+    assert set(tweet["attachment_variants"][0]) == {"w320", "w640", "w1280", "full"}
+
+
+@pytest.mark.asyncio
+async def test_missing_variant_rendered_on_request(ac: AsyncClient, init_db, logger):
+    file = {"file": ("photo.jpg", png_bytes(800, 400), "image/jpeg")}
+    response = await ac.post("/api/medias", files=file)
+    media = await session.get(Media, response.json()["media_id"])
+    await ensure_variants(media.blob)
+    shutil.rmtree(variants_dir(media.blob))
+
+    url = variant_urls(media)["w640"]
+    response = await ac.get(url)
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert (variants_dir(media.blob) / "w640.jpg").exists()
+
+    response = await ac.get(url.replace("w640", "w999"))
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_failed_variants_are_not_rendered_again(ac: AsyncClient, init_db, logger, monkeypatch):
+    file = {"file": ("broken.png", b"not an image", "image/png")}
+    response = await ac.post("/api/medias", files=file)
+    media = await session.get(Media, response.json()["media_id"])
+    assert not await ensure_variants(media.blob)
+
+    def no_pool():
+        raise AssertionError("the failed blob was rendered again")
+
+    monkeypatch.setattr("src.media_storage.get_variant_pool", no_pool)
+    assert not await ensure_variants(media.blob)
+
+
+@pytest.mark.asyncio
+async def test_broken_pool_is_not_remembered_as_a_bad_image(ac: AsyncClient, init_db, logger, monkeypatch):
+    file = {"file": ("pool.png", png_bytes(64, 64), "image/png")}
+    response = await ac.post("/api/medias", files=file)
+    media = await session.get(Media, response.json()["media_id"])
+    await ensure_variants(media.blob)
+    shutil.rmtree(variants_dir(media.blob))
+
+    class BrokenPool:
+        def submit(self, *args):
+            future = Future()
+            future.set_exception(BrokenProcessPool("a worker died"))
+            return future
+
+    with monkeypatch.context() as patch:
+        patch.setattr("src.media_storage.get_variant_pool", BrokenPool)
+        with pytest.raises(BrokenProcessPool):
+            await ensure_variants(media.blob)
+    assert await ensure_variants(media.blob)
+    assert (variants_dir(media.blob) / "w320.png").exists()
@@ -0,0 +1,57 @@
+import json
+
+import pytest
+from httpx import AsyncClient
+
+from .factories import UserFactory, session
+from src.metrics import Metrics, metrics, render
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics(buckets=(0.1, 1.0))
+    metrics.observe_request("GET", "/api/users/{id}", 200, 0.05)
+    metrics.observe_request("GET", "/api/users/{id}", 200, 0.5)
+    metrics.observe_request("GET", "/api/users/{id}", 404, 5)
+    text = render(metrics.collect())
+    labels = 'method="GET",route="/api/users/{id}"'
+    assert f'http_requests_total{{{labels},status="200"}} 2' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="0.1"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="1.0"}} 2' in text
+    assert f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+    assert f"http_request_duration_seconds_count{{{labels}}} 3" in text
+    assert text.count("# TYPE http_request_duration_seconds histogram") == 1
+
+
+def test_snapshots_of_other_workers_are_summed(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.metrics.METRICS_DIR", str(tmp_path))
+    metrics = Metrics()
+    metrics.inc("media_upload_bytes_total", 100)
+    other = [["media_upload_bytes_total", [], 50]]
+    (tmp_path / "metrics-1.json").write_text(json.dumps(other))
+    metrics.flush()
+    assert metrics.gather()[("media_upload_bytes_total", ())] == 150
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(ac: AsyncClient, init_db, logger):
+    test_user = UserFactory.create()
+    session.add(test_user)
+    await session.commit()
+    headers = {"api-key": test_user.api_key}
+    uploaded = metrics.collect().get(("media_upload_bytes_total", ()), 0)
+
+    await ac.get(f"/api/users/{test_user.id}", headers=headers)
+    await ac.post(
+        "/api/medias",
+        headers=headers,
+        files={"file": ("a.png", b"x" * 10, "image/png")},
+    )
+    response = await ac.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'route="/api/users/{id}",status="200"' in text
+    assert f"/api/users/{test_user.id}" not in text
+    assert "db_pool_checked_out" in text
+    assert "auth_cache_hits_total" in text
+    assert f"media_upload_bytes_total {uploaded + 10}" in text
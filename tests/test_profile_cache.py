@@ -0,0 +1,97 @@
+import pytest
+from httpx import AsyncClient
+
+from .factories import UserFactory, session
+from src.profile_cache import ProfileCache, profile_cache
+
+
+@pytest.mark.asyncio
+async def test_profile_page_is_cached_and_revalidated(ac: AsyncClient, init_db, logger):
+    reader = UserFactory.create()
+    star = UserFactory.create()
+    session.add_all([reader, star])
+    await session.commit()
+    headers = {"api-key": reader.api_key}
+
+    hits = profile_cache.hits
+    response = await ac.get(f"/api/users/{star.id}", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    cached = await ac.get(f"/api/users/{star.id}", headers=headers)
+    assert cached.content == response.content
+    assert cached.headers["etag"] == etag
+    assert profile_cache.hits == hits + 1
+
+    response = await ac.get(
+        f"/api/users/{star.id}", headers={**headers, "if-none-match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+    response = await ac.get(
+        f"/api/users/{star.id}", headers={**headers, "if-none-match": f"W/{etag}"}
+    )
+    assert response.status_code == 304
+
+    me = await ac.get("/api/users/me", headers=headers)
+    await ac.post(f"/api/users/{star.id}/follow", headers=headers)
+
+    response = await ac.get(
+        f"/api/users/{star.id}", headers={**headers, "if-none-match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+    assert response.json()["user"]["follower_count"] == 1
+    response = await ac.get("/api/users/me", headers=headers)
+    assert response.headers["etag"] != me.headers["etag"]
+    assert response.json()["user"]["following_count"] == 1
+
+    response = await ac.get("/metrics")
+    assert "profile_cache_hits_total" in response.text
+    assert "profile_cache_invalidation_seconds_total" in response.text
+
+
+@pytest.mark.asyncio
+async def test_batch_follow_invalidates_both_sides(ac: AsyncClient, init_db, logger):
+    reader = UserFactory.create()
+    stars = [UserFactory.create() for _ in range(2)]
+    session.add_all([reader] + stars)
+    await session.commit()
+    headers = {"api-key": reader.api_key}
+    for star in stars:
+        await ac.get(f"/api/users/{star.id}", headers=headers)
+
+    await ac.post(
+        "/api/follows:batch",
+        headers=headers,
+        json={
+            "operations": [{"action": "follow", "user_id": star.id} for star in stars]
+        },
+    )
+    for star in stars:
+        response = await ac.get(f"/api/users/{star.id}", headers=headers)
+        assert response.json()["user"]["follower_count"] == 1
+
+
+def test_invalidated_page_is_held_back():
+    now = [0.0]
+    cache = ProfileCache(10, 60, hold=5, clock=lambda: now[0])
+    cache.render(1, 10, {"user": 1})
+    assert cache.get(1, 10) is not None
+
+    cache.invalidate([1])
+    cache.render(1, 10, {"user": 1})
+    assert cache.get(1, 10) is None
+    now[0] += 6
+    cache.render(1, 10, {"user": 1})
+    assert cache.get(1, 10) is not None
+    assert cache.invalidations == 1
+
+
+def test_only_listed_preview_sizes_are_cached():
+    cache = ProfileCache(10, 60, previews=(10,))
+    for preview in range(101):
+        page = cache.render(1, preview, {"user": 1, "preview": preview})
+        assert page.body
+    assert cache.get(1, 10) is not None
+    assert cache.get(1, 11) is None
+    assert list(cache.pages.get(1)) == [10]
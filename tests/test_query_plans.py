@@ -0,0 +1,186 @@
+import json
+import os
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from src.bulk_load import GraphConfig, bulk_load, generate_graph
+from src.db_services import (
+    FollowersService,
+    LikesService,
+    MediaService,
+    TweetService,
+    UserService,
+)
+from src.models import Base
+
+# every table grows with the number of users, so none of them may be read in
+# full by a request
+LARGE_TABLES = {"users", "tweets", "followers", "likes", "media", "media_blobs"}
+GRAPH = GraphConfig(users=2000, fanout=20, tweets=5, likes=3, seed=3)
+TWEETS = GRAPH.users * GRAPH.tweets
+USER_ID = 7
+OTHER_ID = 11
+TWEET_IDS = [5, 17, 42]
+
+SERVICE_CALLS = {
+    "UserService.get_user_api_key": lambda s: UserService.get_user_api_key(
+        s, "bench-7"
+    ),
+    "UserService.change_follow_counts": lambda s: UserService.change_follow_counts(
+        s, USER_ID, OTHER_ID, 1
+    ),
+    "UserService.get_profile": lambda s: UserService.get_profile(s, USER_ID),
+    "UserService.get_users_short": lambda s: UserService.get_users_short(
+        s, [USER_ID, OTHER_ID]
+    ),
+    "TweetService.get_tweet": lambda s: TweetService.get_tweet(s, TWEET_IDS[0]),
+    "TweetService.get_tweets_by_ids": lambda s: TweetService.get_tweets_by_ids(
+        s, TWEET_IDS
+    ),
+    "TweetService.get_feed_versions": lambda s: TweetService.get_feed_versions(
+        s, USER_ID, 50
+    ),
+    "TweetService.get_feed_versions with cursor": lambda s: (
+        TweetService.get_feed_versions(
+            s,
+            USER_ID,
+            50,
+            cursor=(datetime.utcnow() - timedelta(seconds=TWEETS // 2), 1),
+        )
+    ),
+    "TweetService.get_versions_by_ids": lambda s: TweetService.get_versions_by_ids(
+        s, TWEET_IDS
+    ),
+    "TweetService.get_timeline_entries": lambda s: TweetService.get_timeline_entries(
+        s, USER_ID, 800
+    ),
+    "TweetService.change_like_count": lambda s: TweetService.change_like_count(
+        s, TWEET_IDS[0], 1
+    ),
+    "TweetService.soft_delete": lambda s: TweetService.soft_delete(
+        s, TWEET_IDS[0], USER_ID
+    ),
+    "TweetService.get_deleted_ids": lambda s: TweetService.get_deleted_ids(s, 100),
+    "TweetService.purge_tweet": lambda s: TweetService.purge_tweet(s, TWEET_IDS[0]),
+    "MediaService.delete_tweet_media": lambda s: MediaService.delete_tweet_media(
+        s, TWEET_IDS[0]
+    ),
+    "MediaService.get_media_lst": lambda s: MediaService.get_media_lst(s, [1, 2]),
+    "MediaService.acquire_blob": lambda s: MediaService.acquire_blob(
+        s, f"{1:064x}.jpg", 10
+    ),
+    "MediaService.release_blobs": lambda s: MediaService.release_blobs(
+        s, [f"{1:064x}.jpg"]
+    ),
+    "MediaService.get_released_blobs": lambda s: MediaService.get_released_blobs(
+        s, datetime.utcnow(), 100
+    ),
+    "MediaService.delete_released_blob": lambda s: MediaService.delete_released_blob(
+        s, f"{1:064x}.jpg"
+    ),
+    "LikesService.add_like": lambda s: LikesService.add_like(s, TWEET_IDS[0], USER_ID),
+    "LikesService.remove_like": lambda s: LikesService.remove_like(
+        s, TWEET_IDS[0], USER_ID
+    ),
+    "LikesService.delete_likes_chunk": lambda s: LikesService.delete_likes_chunk(
+        s, TWEET_IDS[0], 1000
+    ),
+    "LikesService.get_likers_preview": lambda s: LikesService.get_likers_preview(
+        s, TWEET_IDS, 3
+    ),
+    "FollowersService.add_follow": lambda s: FollowersService.add_follow(
+        s, USER_ID, OTHER_ID
+    ),
+    "FollowersService.remove_follow": lambda s: FollowersService.remove_follow(
+        s, USER_ID, OTHER_ID
+    ),
+    "FollowersService.get_followers_ids": lambda s: FollowersService.get_followers_ids(
+        s, USER_ID
+    ),
+    "FollowersService.get_following_ids": lambda s: FollowersService.get_following_ids(
+        s, USER_ID
+    ),
+    "FollowersService.get_followers_page": lambda s: (
+        FollowersService.get_followers_page(s, USER_ID, 100, after=3)
+    ),
+    "FollowersService.get_following_page": lambda s: (
+        FollowersService.get_following_page(s, USER_ID, 100, after=3)
+    ),
+}
+
+
+def media_sources():
+    started = datetime.utcnow() - timedelta(days=1)
+    blobs = [(f"{n:064x}.jpg", 1000, 1, started) for n in range(1, TWEETS + 1)]
+    media = [(n, ".jpg", n, blob[0]) for n, blob in enumerate(blobs, 1)]
+    return {
+        "media_blobs": (("name", "size", "ref_count", "updated_at"), blobs),
+        "media": (("id", "extension", "tweet_id", "blob"), media),
+    }
+
+
+@pytest.fixture(scope="module")
+async def plans_engine(tmp_path_factory):
+    # DATABASE_URL_PLANS points the checks at an empty Postgres database
+    url = os.getenv("DATABASE_URL_PLANS") or (
+        f"sqlite+aiosqlite:///{tmp_path_factory.mktemp('plans')}/plans.db"
+    )
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    await bulk_load(generate_graph(GRAPH), engine)
+    await bulk_load(media_sources(), engine)
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("ANALYZE")
+    yield engine
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await engine.dispose()
+
+
+async def explain(conn, statement, parameters) -> list:
+    """Return the tables the statement reads in full."""
+    if conn.dialect.name == "postgresql":
+        result = await conn.exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {statement}", parameters
+        )
+        plan = result.scalar()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        nodes, scans = [plan[0]["Plan"]], []
+        while nodes:
+            node = nodes.pop()
+            if node["Node Type"] == "Seq Scan":
+                scans.append(node["Relation Name"])
+            nodes.extend(node.get("Plans", []))
+        return scans
+    result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    # "SCAN t" and "SCAN t USING INDEX" both visit every row, "SEARCH" does not
+    return [
+        match.group(1) for row in result if (match := re.match(r"SCAN (\w+)", row[-1]))
+    ]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", SERVICE_CALLS)
+async def test_service_queries_use_indexes(plans_engine, name):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    async with plans_engine.connect() as conn:
+        event.listen(conn.sync_connection, "before_cursor_execute", capture)
+        async with AsyncSession(bind=conn) as session:
+            await SERVICE_CALLS[name](session)
+        event.remove(conn.sync_connection, "before_cursor_execute", capture)
+        assert statements
+
+        for statement, parameters in statements:
+            scans = set(await explain(conn, statement, parameters)) & LARGE_TABLES
+            assert not scans, f"{name} scans {sorted(scans)}: {statement}"
+        await conn.rollback()
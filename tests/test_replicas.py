@@ -0,0 +1,64 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from .factories import UserFactory, TweetFactory, FollowersFactory, session
+from src.cache import TTLCache
+from src.models import Base, Followers, Tweets, Users
+
+
+@pytest.fixture
+async def replica_engine(tmp_path, monkeypatch):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/replica.db")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    monkeypatch.setattr("src.replicas.replicas", [engine])
+    yield engine
+    await engine.dispose()
+
+
+async def feed(ac: AsyncClient, user: Users) -> list:
+    response = await ac.get("/api/tweets", headers={"api-key": user.api_key})
+    return [tweet["content"] for tweet in response.json()["tweets"]]
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_replica_except_after_own_writes(
+    ac: AsyncClient, init_db, logger, replica_engine, monkeypatch
+):
+    now = [0.0]
+    monkeypatch.setattr(
+        "src.replicas.recent_writers", TTLCache(100, 5, clock=lambda: now[0])
+    )
+    author = UserFactory.create()
+    reader = UserFactory.create()
+    session.add_all([author, reader])
+    await session.commit()
+    session.add(FollowersFactory(user_id=reader.id, follower_id=author.id))
+    tweet = TweetFactory.create(author=author.id, content="on the primary")
+    session.add(tweet)
+    await session.commit()
+
+    # the replica holds an older state of the same users
+    async with AsyncSession(replica_engine) as replica:
+        for user in (author, reader):
+            replica.add(Users(id=user.id, name="stale", api_key=user.api_key))
+        replica.add(Followers(user_id=reader.id, follower_id=author.id))
+        replica.add(Tweets(id=tweet.id, author=author.id, content="on the replica"))
+        await replica.commit()
+
+    assert await feed(ac, reader) == ["on the replica"]
+    response = await ac.get("/api/users/me", headers={"api-key": reader.api_key})
+    assert response.json()["user"]["name"] == "stale"
+
+    response = await ac.post(
+        f"/api/tweets/{tweet.id}/likes", headers={"api-key": reader.api_key}
+    )
+    assert response.status_code == 200
+    assert await feed(ac, reader) == ["on the primary"]
+    # only the writer is pinned to the primary
+    response = await ac.get("/api/users/me", headers={"api-key": author.api_key})
+    assert response.json()["user"]["name"] == "stale"
+
+    now[0] += 6
+    assert await feed(ac, reader) == ["on the replica"]
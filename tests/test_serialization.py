@@ -0,0 +1,62 @@
+import json
+
+import pytest
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from httpx import AsyncClient
+
+from .factories import (
+    UserFactory,
+    TweetFactory,
+    MediaFactory,
+    LikesFactory,
+    FollowersFactory,
+    session,
+)
+from src.main import app
+
+
+async def legacy_body(path: str, body: bytes) -> bytes:
+    """Encode a response the way FastAPI does for a returned dict."""
+    route = next(
+        route
+        for route in app.routes
+        if getattr(route, "path", None) == path and "GET" in route.methods
+    )
+    content = await serialize_response(
+        field=route.response_field, response_content=json.loads(body)
+    )
+    return JSONResponse(content).body
+
+
+@pytest.mark.asyncio
+async def test_fast_responses_match_the_validated_ones(
+    ac: AsyncClient, init_db, logger
+):
+    reader = UserFactory.create(name='Ридер "quoted" \\ back/slash')
+    author = UserFactory.create(name="작가 🚀")
+    session.add_all([reader, author])
+    await session.commit()
+    session.add(FollowersFactory(user_id=reader.id, follower_id=author.id))
+    tweets = [
+        TweetFactory.create(author=author.id, content=content)
+        for content in ["plain", "tab\tnew\nline   \x01 \x7f", "émoji 😀 &<>"]
+    ]
+    session.add_all(tweets)
+    await session.commit()
+    session.add(MediaFactory.create(tweet_id=tweets[0].id))
+    session.add(LikesFactory(user_id=reader.id, tweet_id=tweets[1].id))
+    await session.commit()
+    headers = {"api-key": reader.api_key}
+
+    for url, path in [
+        ("/api/tweets", "/api/tweets"),
+        ("/api/tweets?limit=1", "/api/tweets"),
+        ("/api/tweets?preview=1", "/api/tweets"),
+        ("/api/users/me", "/api/users/me"),
+        (f"/api/users/{author.id}", "/api/users/{id}"),
+    ]:
+        response = await ac.get(url, headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/json"
+        assert response.content == await legacy_body(path, response.content), url
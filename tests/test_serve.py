@@ -0,0 +1,138 @@
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import httpx
+import pytest
+from alembic.script import ScriptDirectory
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src import serve
+from src.serve import alembic_config
+
+WORKERS = 3
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def started_workers(log_dir: Path) -> set:
+    return {
+        path.name
+        for path in log_dir.glob("app.*.log")
+        if "started in" in path.read_text()
+    }
+
+
+def test_serve_migrates_once_and_starts_workers(tmp_path):
+    port = free_port()
+    env = {
+        **os.environ,
+        "ENV": "production",
+        "DATABASE_URL": f"sqlite+aiosqlite:///{tmp_path}/serve.db",
+        "DATABASE_URL_REPLICAS": "",
+        "LOG_FILE": str(tmp_path / "log" / "app.log"),
+        "ACCESS_LOG_FILE": str(tmp_path / "log" / "access.log"),
+        "METRICS_DIR": str(tmp_path / "metrics"),
+        "MEDIA_ROOT": str(tmp_path / "storage"),
+        "SERVE_HOST": "127.0.0.1",
+        "SERVE_PORT": str(port),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "src.serve", "--workers", str(WORKERS)],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while len(started_workers(tmp_path / "log")) < WORKERS:
+            assert server.poll() is None, "server exited during startup"
+            assert time.monotonic() < deadline, "workers did not start in time"
+            time.sleep(0.2)
+
+        response = httpx.get(f"http://127.0.0.1:{port}/api/users/me")
+        assert response.status_code == 400
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    head = ScriptDirectory.from_config(alembic_config()).get_current_head()
+    with sqlite3.connect(tmp_path / "serve.db") as db:
+        assert db.execute("SELECT version_num FROM alembic_version").fetchall() == [
+            (head,)
+        ]
+
+
+def test_fanout_refuses_several_workers(monkeypatch):
+    monkeypatch.setattr(serve, "TIMELINE_FANOUT", True)
+    monkeypatch.setattr(serve.uvicorn, "run", lambda *args, **kwargs: None)
+    # serve() sets these for the workers it would spawn
+    monkeypatch.setenv("DB_CREATE_ALL", os.getenv("DB_CREATE_ALL", "true"))
+    monkeypatch.setenv("LOG_PER_PROCESS", os.getenv("LOG_PER_PROCESS", "false"))
+    with pytest.raises(SystemExit):
+        serve.serve(2)
+    serve.serve(1)
+
+
+# the tables create_all built at startup before the app used Alembic
+UNVERSIONED_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(50) NOT NULL,"
+    " api_key VARCHAR(50) NOT NULL)",
+    "CREATE TABLE followers (user_id INTEGER NOT NULL, follower_id INTEGER NOT NULL,"
+    " PRIMARY KEY (follower_id, user_id))",
+    "CREATE TABLE tweets (id INTEGER PRIMARY KEY, content VARCHAR(500) NOT NULL,"
+    " author INTEGER NOT NULL)",
+    "CREATE TABLE media (id INTEGER PRIMARY KEY, extension VARCHAR, tweet_id INTEGER)",
+    "CREATE TABLE likes (tweet_id INTEGER NOT NULL, user_id INTEGER NOT NULL,"
+    " PRIMARY KEY (tweet_id, user_id))",
+]
+
+
+def test_migrate_stamps_a_database_built_before_alembic(tmp_path, monkeypatch):
+    calls = []
+
+    class Command:
+        @staticmethod
+        def stamp(config, revision):
+            calls.append(("stamp", revision))
+
+        @staticmethod
+        def upgrade(config, revision):
+            calls.append(("upgrade", revision))
+
+    # the revisions use PostgreSQL DDL, so only the alembic calls are checked
+    monkeypatch.setattr(serve, "command", Command)
+    monkeypatch.setattr(serve, "alembic_config", lambda: None)
+
+    def migrate(name, statements):
+        url = f"sqlite+aiosqlite:///{tmp_path}/{name}.db"
+        with sqlite3.connect(tmp_path / f"{name}.db") as db:
+            for statement in statements:
+                db.execute(statement)
+        monkeypatch.setattr(serve, "engine", create_async_engine(url))
+        calls.clear()
+        # asyncio.run in this thread would close the loop the async tests share
+        with ThreadPoolExecutor(1) as executor:
+            executor.submit(serve.migrate).result()
+        return list(calls)
+
+    assert migrate("empty", []) == [("stamp", "head"), ("upgrade", "head")]
+    assert migrate("unversioned", UNVERSIONED_SCHEMA) == [
+        ("stamp", "5e3cebe3306e"),
+        ("upgrade", "head"),
+    ]
+    versioned = UNVERSIONED_SCHEMA + [
+        "CREATE TABLE alembic_version (version_num VARCHAR(32) NOT NULL)"
+    ]
+    assert migrate("versioned", versioned) == [("upgrade", "head")]
@@ -0,0 +1,135 @@
+import asyncio
+import os
+import signal
+from datetime import datetime, timedelta
+
+import pytest
+from httpx import AsyncClient
+
+from .factories import UserFactory, TweetFactory, FollowersFactory, session
+from src.timeline import MemoryTimelineStore, rebuild_timelines, timeline_store
+
+
+def make_entries(count):
+    start = datetime(2024, 1, 1)
+    return [(start + timedelta(minutes=i), i + 1) for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_memory_store_pages_newest_first():
+    store = MemoryTimelineStore(max_length=10)
+    entries = make_entries(5)
+    await store.replace(1, entries, complete=True)
+
+    page = await store.get(1, 3)
+    assert [id for _, id in page] == [5, 4, 3]
+    page = await store.get(1, 3, page[-1])
+    assert [id for _, id in page] == [2, 1]
+    assert await store.get(2, 3) is None
+
+
+@pytest.mark.asyncio
+async def test_memory_store_is_bounded():
+    store = MemoryTimelineStore(max_length=3)
+    entries = make_entries(5)
+    await store.replace(1, entries[:2], complete=True)
+    for entry in entries[2:]:
+        await store.push([1, 2], entry)
+
+    assert [id for _, id in await store.get(1, 3)] == [5, 4, 3]
+    # the oldest entries were trimmed, so a deeper page must go to the database
+    assert await store.get(1, 2, entries[3]) is None
+    # pushes never create timelines that were not built
+    assert not await store.exists(2)
+
+
+@pytest.mark.asyncio
+async def test_fanout_timeline(ac: AsyncClient, init_db, logger, monkeypatch):
+    monkeypatch.setattr("src.main.TIMELINE_FANOUT", True)
+    test_user = UserFactory.create()
+    test_user2 = UserFactory.create()
+    session.add(test_user)
+    session.add(test_user2)
+    await session.commit()
+    session.add(FollowersFactory(user_id=test_user.id, follower_id=test_user2.id))
+    old_tweet = TweetFactory.create(author=test_user2.id)
+    session.add(old_tweet)
+    await session.commit()
+
+    headers = {"api-key": test_user.api_key}
+    response = await ac.get("/api/tweets", headers=headers)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [old_tweet.id]
+    assert await timeline_store.exists(test_user.id)
+
+    headers2 = {"api-key": test_user2.api_key}
+    response = await ac.post("/api/tweets", json={"tweet_data": "new"}, headers=headers2)
+    new_id = response.json()["id"]
+    assert [id for _, id in await timeline_store.get(test_user.id, 10)] == [
+        new_id,
+        old_tweet.id,
+    ]
+    response = await ac.get("/api/tweets", headers=headers)
+    assert [tweet["id"] for tweet in response.json()["tweets"]] == [new_id, old_tweet.id]
+
+    await ac.delete(f"/api/tweets/{new_id}", headers=headers2)
+    assert [id for _, id in await timeline_store.get(test_user.id, 10)] == [old_tweet.id]
+
+    await ac.delete(f"/api/users/{test_user2.id}/follow", headers=headers)
+    assert not await timeline_store.exists(test_user.id)
+    response = await ac.get("/api/tweets", headers=headers)
+    assert response.json()["tweets"] == []
+
+
+@pytest.mark.asyncio
+async def test_rebuild_timelines(ac: AsyncClient, init_db):
+    test_user = UserFactory.create()
+    test_user2 = UserFactory.create()
+    session.add(test_user)
+    session.add(test_user2)
+    await session.commit()
+    session.add(FollowersFactory(user_id=test_user.id, follower_id=test_user2.id))
+    test_tweets = [TweetFactory.create(author=test_user2.id) for _ in range(3)]
+    session.add_all(test_tweets)
+    await session.commit()
+
+    store = MemoryTimelineStore(max_length=10)
+    count = await rebuild_timelines(session, [test_user.id, test_user2.id], store)
+
+    assert count == 2
+    assert [id for _, id in await store.get(test_user.id, 10)] == [
+        tweet.id for tweet in reversed(test_tweets)
+    ]
+    assert await store.get(test_user2.id, 10) == []
+
+
+@pytest.mark.asyncio
+async def test_sighup_rebuilds_drifted_timelines(ac: AsyncClient, init_db, logger):
+    from src.main import start_timeline_rebuilds, stop_timeline_rebuilds
+
+    test_user = UserFactory.create()
+    test_user2 = UserFactory.create()
+    session.add_all([test_user, test_user2])
+    await session.commit()
+    session.add(FollowersFactory(user_id=test_user.id, follower_id=test_user2.id))
+    test_tweets = [TweetFactory.create(author=test_user2.id) for _ in range(2)]
+    session.add_all(test_tweets)
+    await session.commit()
+
+    await rebuild_timelines(session, [test_user.id])
+    # a timeline that missed a tweet keeps being served as it is
+    await timeline_store.remove([test_user.id], test_tweets[0].id)
+    assert len(await timeline_store.get(test_user.id, 10)) == 1
+
+    start_timeline_rebuilds()
+    try:
+        os.kill(os.getpid(), signal.SIGHUP)
+        for _ in range(100):
+            if len(await timeline_store.get(test_user.id, 10)) == 2:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        stop_timeline_rebuilds()
+    assert [id for _, id in await timeline_store.get(test_user.id, 10)] == [
+        tweet.id for tweet in reversed(test_tweets)
+    ]
+    await timeline_store.discard(test_user.id)
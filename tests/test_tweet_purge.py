@@ -0,0 +1,83 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import func
+from sqlalchemy.future import select
+
+from .factories import (
+    UserFactory,
+    TweetFactory,
+    MediaFactory,
+    LikesFactory,
+    FollowersFactory,
+    session,
+)
+from src.media_storage import legacy_media_path
+from src.models import Likes, Media, Tweets
+from src.tweet_purge import purge_deleted_tweets
+
+
+async def count(model, **filters):
+    result = await session.execute(
+        select(func.count()).select_from(model).filter_by(**filters)
+    )
+    return result.scalar()
+
+
+@pytest.mark.asyncio
+async def test_deleted_tweet_is_purged_in_background(
+    ac: AsyncClient, init_db, logger, monkeypatch
+):
+    author = UserFactory.create()
+    reader = UserFactory.create()
+    fans = [UserFactory.create() for _ in range(5)]
+    session.add_all([author, reader] + fans)
+    await session.commit()
+    session.add(FollowersFactory(user_id=reader.id, follower_id=author.id))
+    tweet = TweetFactory.create(author=author.id)
+    session.add(tweet)
+    await session.commit()
+    media = MediaFactory.create(tweet_id=tweet.id)
+    session.add(media)
+    session.add_all([LikesFactory(user_id=fan.id, tweet_id=tweet.id) for fan in fans])
+    await session.commit()
+    legacy_file = legacy_media_path(media.id, media.extension)
+    legacy_file.parent.mkdir(parents=True, exist_ok=True)
+    legacy_file.write_bytes(b"old upload")
+    tweet_id = tweet.id
+
+    response = await ac.delete(
+        f"/api/tweets/{tweet_id}", headers={"api-key": author.api_key}
+    )
+    assert response.status_code == 200
+    response = await ac.get("/api/tweets", headers={"api-key": reader.api_key})
+    assert tweet_id not in [t["id"] for t in response.json()["tweets"]]
+    response = await ac.post(
+        f"/api/tweets/{tweet_id}/likes", headers={"api-key": reader.api_key}
+    )
+    assert response.json() == {"error": "No such tweet in database."}
+    assert await count(Likes, tweet_id=tweet_id) == 5
+
+    monkeypatch.setattr("src.tweet_purge.TWEET_PURGE_CHUNK", 2)
+    assert await purge_deleted_tweets(session) >= 1
+    assert await count(Likes, tweet_id=tweet_id) == 0
+    assert await count(Media, tweet_id=tweet_id) == 0
+    assert await count(Tweets, id=tweet_id) == 0
+    assert not legacy_file.exists()
+
+
+@pytest.mark.asyncio
+async def test_delete_checks_the_author(ac: AsyncClient, init_db, logger):
+    author = UserFactory.create()
+    other = UserFactory.create()
+    session.add_all([author, other])
+    await session.commit()
+    tweet = TweetFactory.create(author=author.id)
+    session.add(tweet)
+    await session.commit()
+
+    response = await ac.delete(
+        f"/api/tweets/{tweet.id}", headers={"api-key": other.api_key}
+    )
+    assert response.json() == {"error": "You cannot delete tweet of the other user."}
+    response = await ac.delete("/api/tweets/100000", headers={"api-key": other.api_key})
+    assert response.json() == {"error": "No such tweet in database."}
@@ -0,0 +1,120 @@
+import asyncio
+
+import orjson
+import pytest
+from httpx import AsyncClient
+
+from .factories import UserFactory, FollowersFactory, session
+from src import tweet_stream as stream_module
+from src.main import app
+from src.tweet_stream import EventStreamResponse, TweetStream, encode_event
+
+
+def test_events_reach_followers_of_the_author():
+    stream = TweetStream()
+    reader = stream.subscribe(1, [7])
+    other = stream.subscribe(2, [8])
+
+    stream.publish(7, "tweet", {"id": 1, "author": 7})
+    assert list(reader.events) == [encode_event("tweet", {"id": 1, "author": 7})]
+    assert not other.events
+
+    stream.follow(2, [7])
+    stream.unfollow(1, [7])
+    stream.publish(7, "likes", {"id": 1, "delta": 1})
+    assert len(reader.events) == 1
+    assert len(other.events) == 1
+
+    stream.unsubscribe(reader)
+    stream.unsubscribe(other)
+    assert len(stream) == 0
+    assert not stream._by_author
+
+
+def test_full_queue_closes_the_subscriber(monkeypatch):
+    monkeypatch.setattr(stream_module, "STREAM_QUEUE_SIZE", 2)
+    stream = TweetStream()
+    subscriber = stream.subscribe(1, [7])
+    for tweet_id in range(3):
+        stream.publish(7, "tweet", {"id": tweet_id, "author": 7})
+    assert subscriber.closed
+    assert subscriber.overflowed
+    stream.unsubscribe(subscriber)
+    assert stream.slow_disconnects == 1
+
+
+def stream_scope(api_key: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/api/tweets/stream",
+        "raw_path": b"/api/tweets/stream",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"test"), (b"api-key", api_key.encode())],
+        "client": ("127.0.0.1", 1234),
+        "server": ("test", 80),
+    }
+
+
+@pytest.mark.asyncio
+async def test_stream_pushes_new_tweets(ac: AsyncClient, init_db, logger):
+    reader = UserFactory.create()
+    author = UserFactory.create()
+    session.add_all([reader, author])
+    await session.commit()
+    session.add(FollowersFactory(user_id=reader.id, follower_id=author.id))
+    await session.commit()
+
+    disconnected = asyncio.Event()
+    messages = asyncio.Queue()
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        await messages.put(message)
+
+    task = asyncio.create_task(app(stream_scope(reader.api_key), receive, send))
+    start = await asyncio.wait_for(messages.get(), 5)
+    assert start["status"] == 200
+    assert (b"content-type", b"text/event-stream; charset=utf-8") in start["headers"]
+    assert (await messages.get())["body"].startswith(b"retry:")
+
+    response = await ac.post(
+        "/api/tweets",
+        headers={"api-key": author.api_key},
+        json={"tweet_data": "streamed"},
+    )
+    tweet_id = response.json()["id"]
+    body = (await asyncio.wait_for(messages.get(), 5))["body"]
+    assert body.startswith(b"event: tweet\n")
+    data = orjson.loads(body.split(b"data: ")[1])
+    assert data == {"id": tweet_id, "author": author.id}
+
+    disconnected.set()
+    await asyncio.wait_for(task, 5)
+
+
+@pytest.mark.asyncio
+async def test_slow_consumer_is_disconnected(monkeypatch):
+    monkeypatch.setattr(stream_module, "STREAM_SEND_TIMEOUT", 0.05)
+    stream = TweetStream()
+    stuck = asyncio.Event()
+
+    async def receive():
+        await stuck.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            await stuck.wait()
+
+    response = EventStreamResponse(1, [7], stream)
+    await asyncio.wait_for(response(stream_scope("key"), receive, send), 5)
+    assert stream.slow_disconnects == 1
+    assert len(stream) == 0